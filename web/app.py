@@ -1,64 +1,39 @@
 import os
+import time
 import uuid
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+import threading
+from flask import Flask, Blueprint, render_template, request, jsonify, session, redirect, url_for
 from datetime import datetime, date, timedelta, timezone
 from collections import defaultdict
 from functools import wraps
-from werkzeug.security import generate_password_hash, check_password_hash
-
-# --- Firebase Initialization ---
-try:
-    import firebase_admin
-    from firebase_admin import credentials, firestore
-    FIREBASE_AVAILABLE = True
-except ImportError:
-    FIREBASE_AVAILABLE = False
-
-app = Flask(__name__,
-    template_folder='templates',
-    static_folder='static'
-)
-app.secret_key = os.environ.get('SECRET_KEY', 'a-very-secret-key-for-dev')
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
-
-db = None
-if FIREBASE_AVAILABLE:
-    try:
-        required_env_vars = ['FIREBASE_PROJECT_ID', 'FIREBASE_PRIVATE_KEY', 'FIREBASE_CLIENT_EMAIL']
-        if all(os.getenv(key) for key in required_env_vars):
-            print("Attempting to initialize Firebase with environment variables...")
-            private_key = os.getenv('FIREBASE_PRIVATE_KEY').replace('\\n', '\n')
-            firebase_config = {
-                "type": "service_account",
-                "project_id": os.getenv('FIREBASE_PROJECT_ID'),
-                "private_key_id": os.getenv('FIREBASE_PRIVATE_KEY_ID', ''),
-                "private_key": private_key,
-                "client_email": os.getenv('FIREBASE_CLIENT_EMAIL'),
-                "client_id": os.getenv('FIREBASE_CLIENT_ID', ''),
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-                "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-            }
-            cred = credentials.Certificate(firebase_config)
-            print("Firebase credentials loaded from environment.")
-        elif os.path.exists('firebase-key.json'):
-            print("Attempting to initialize Firebase with firebase-key.json...")
-            cred = credentials.Certificate('firebase-key.json')
-            print("Firebase credentials loaded from file.")
-        else:
-            raise Exception("No Firebase configuration found. Set environment variables or provide firebase-key.json.")
-        
-        if not firebase_admin._apps:
-            firebase_admin.initialize_app(cred)
-        
-        db = firestore.client()
-        print("✅ Firebase initialized successfully")
-    except Exception as e:
-        print(f"❌ Firebase init error: {e}")
-        db = None
-        FIREBASE_AVAILABLE = False
-else:
-    print("⚠️ Firebase library not found. Running in offline mode.")
+from hashing import hash_password, verify_password, needs_rehash, HashingBusy
+import jobs
+import search_index
+import singleflight
+import archive
+import forecast
+import storage
+
+# The storage client is created lazily, per process (see storage.py).
+db = storage.db
+
+bp = Blueprint('coin', __name__)
+
+ADMIN_ROLLUP_MAX_AGE = timedelta(minutes=int(os.environ.get('ADMIN_ROLLUP_MAX_AGE_MINUTES', 10)))
+
+# --- Request Coalescing ---
+# Concurrent identical reads within a worker share one storage read and one
+# computed result (see singleflight.py). Shared results are read-only.
+read_flight = singleflight.Group()       # (user_id, profile) -> get_data()
+dashboard_flight = singleflight.Group()  # (user_id, profile, version) -> /api/data payload
+admin_flight = singleflight.Group()      # admin panel reads
+
+# (user_id, profile) -> when this worker last queued a compaction for it, so
+# reads of an old profile don't queue a job on every request. Entries older
+# than COMPACTION_REQUEST_INTERVAL are dropped as new ones are added.
+COMPACTION_REQUEST_INTERVAL = 60
+compaction_requested = {}
+compaction_requested_lock = threading.Lock()
 
 # --- Login Decorator ---
 def login_required(f):
@@ -67,7 +42,7 @@ def login_required(f):
         if 'user_id' not in session:
             if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
                 return jsonify({'error': 'Unauthorized', 'success': False}), 401
-            return redirect(url_for('login'))
+            return redirect(url_for('coin.login'))
         return f(*args, **kwargs)
     return decorated_function
 
@@ -90,7 +65,8 @@ def dt_now_iso():
     return datetime.now(timezone.utc).isoformat()
 
 # --- Achievement Calculation Function ---
-def calculate_achievements(transactions, balance, goal):
+def calculate_achievements(transactions, balance, goal, archived=None):
+    # archived: archive.totals() of the profile's snapshots, if it has any.
     achievements = []
     today = datetime.now(timezone.utc).date()
 
@@ -132,6 +108,8 @@ def calculate_achievements(transactions, balance, goal):
         login_dates = set()
         for t in login_transactions:
             login_dates.add(datetime.fromisoformat(t['date'].replace('Z', '+00:00')).date())
+        if archived:
+            login_dates.update(date.fromisoformat(d) for d in archived['login_days'])
 
         streak = 0
         if today in login_dates:
@@ -160,14 +138,19 @@ def calculate_achievements(transactions, balance, goal):
             if t.get('amount', 0) < 0:
                 last_spend_date = datetime.fromisoformat(t['date'].replace('Z', '+00:00')).date()
                 break
+        if last_spend_date is None and archived and archived['last_spend_date']:
+            last_spend_date = datetime.fromisoformat(archived['last_spend_date'].replace('Z', '+00:00')).date()
         
         no_spend_days = 0
         if last_spend_date:
             no_spend_days = (today - last_spend_date).days
         else:
             # Never spent? That's a full streak!
-            if sorted_tx: # Check if there are any transactions at all
-                 first_tx_date = datetime.fromisoformat(sorted_tx[0]['date'].replace('Z', '+00:00')).date()
+            first_tx_date_str = archived['first_date'] if archived and archived['first_date'] else None
+            if first_tx_date_str is None and sorted_tx: # Check if there are any transactions at all
+                first_tx_date_str = sorted_tx[0]['date']
+            if first_tx_date_str:
+                 first_tx_date = datetime.fromisoformat(first_tx_date_str.replace('Z', '+00:00')).date()
                  no_spend_days = (today - first_tx_date).days
             
         if no_spend_days >= 7:
@@ -184,12 +167,24 @@ def calculate_achievements(transactions, balance, goal):
 
 
 # --- Data Access Class ---
+class SettingsConflict(Exception):
+    """Settings kept changing while a read-modify-write retried."""
+
 class WebCoinTracker:
     def __init__(self, profile_name="Default", user_id="default_user"):
         self.profile_name = profile_name
         self.user_id = user_id
+        # last_updated of the profile as last read or written; used to tell
+        # whether cached per-profile state (e.g. the search index) is current.
+        self.version = None
+        # Monthly summaries of archived transactions (see archive.py).
+        self.snapshots = []
+        # updated_at of the profile's settings document, if it has one.
+        self.settings_version = None
+        # Stored earning-rate state (see forecast.py), None until built.
+        self.forecast = None
         self.db = db
-        self.doc_ref = self.db.collection('user_data').document(self.user_id) if self.db and FIREBASE_AVAILABLE else None
+        self.doc_ref = self.db.collection('user_data').document(self.user_id) if self.db else None
 
     def get_default_settings(self):
         return {
@@ -205,12 +200,24 @@ class WebCoinTracker:
             ]
         }
 
+    def settings_ref(self):
+        # Settings and quick actions live in their own small document so they
+        # can be changed without rewriting (or racing) the transaction list.
+        return self.doc_ref.collection('settings').document(archive.profile_key(self.profile_name))
+
     def get_data(self):
         transactions, settings = [], self.get_default_settings()
         if self.doc_ref:
             try:
-                doc = self.doc_ref.get()
-                if doc.exists:
+                # One round trip for both documents.
+                doc, settings_doc = None, None
+                for snapshot in self.db.get_all([self.doc_ref, self.settings_ref()]):
+                    if snapshot.reference.path == self.doc_ref.path:
+                        doc = snapshot
+                    else:
+                        settings_doc = snapshot
+
+                if doc is not None and doc.exists:
                     data = doc.to_dict()
 
                     if data is None: 
@@ -220,11 +227,24 @@ class WebCoinTracker:
                         profile_data = data.get('profiles', {}).get(self.profile_name, {})
                         transactions = profile_data.get('transactions', [])
                         settings.update(profile_data.get('settings', {}))
+                        self.version = profile_data.get('last_updated')
+                        self.snapshots = profile_data.get('snapshots', [])
+                        self.forecast = profile_data.get('forecast')
+                        self.schedule_compaction(transactions)
                     
                     elif 'transactions' in data or 'settings' in data:
-                        print(f"NOTE: Found old data structure for user {self.user_id}. Reading data...")
+                        print(f"NOTE: Found old data structure for user {self.user_id}. Queuing migration...")
                         transactions = data.get('transactions', [])
                         settings.update(data.get('settings', {}))
+                        jobs.enqueue('migrate_legacy_data', {'user_id': self.user_id},
+                                     created_by=self.user_id, dedupe_key=f"migrate_legacy_data:{self.user_id}")
+
+                # Profiles created before settings were split out keep them
+                # embedded until their first settings change.
+                if settings_doc is not None and settings_doc.exists:
+                    stored_settings = settings_doc.to_dict() or {}
+                    self.settings_version = stored_settings.pop('updated_at', None)
+                    settings.update(stored_settings)
                     
             except Exception as e: 
                 print(f"Firebase load error for user {self.user_id}: {e}")
@@ -232,68 +252,71 @@ class WebCoinTracker:
             profile_data = session.get('profiles', {}).get(self.profile_name, {})
             transactions = profile_data.get('transactions', [])
             settings.update(profile_data.get('settings', {}))
+            self.version = profile_data.get('last_updated')
+            self.snapshots = profile_data.get('snapshots', [])
+            self.forecast = profile_data.get('forecast')
         
         return self.validate_data(transactions, settings)
 
-    def get_transactions_paginated(self, page=1, limit=20, filters=None):
+    def get_data_shared(self):
+        # For read-only callers: concurrent reads of the same profile share
+        # one in-flight storage read. The returned lists must not be modified.
+        if not self.doc_ref:
+            return self.get_data()
+
+        def read():
+            transactions, settings = self.get_data()
+            return transactions, settings, self.version, self.snapshots, self.settings_version, self.forecast
+
+        (transactions, settings, self.version, self.snapshots,
+         self.settings_version, self.forecast) = read_flight.do((self.user_id, self.profile_name), read)
+        return transactions, settings
+
+    def get_version(self):
+        if self.doc_ref:
+            try:
+                # Field mask: only the profile's last_updated is downloaded.
+                doc = self.doc_ref.get(field_paths=[storage.FieldPath('profiles', self.profile_name, 'last_updated').to_api_repr()])
+                if doc.exists and doc.to_dict() is not None:
+                    return doc.to_dict().get('profiles', {}).get(self.profile_name, {}).get('last_updated')
+            except Exception as e:
+                print(f"Firebase version read error for user {self.user_id}: {e}")
+            return None
+        return session.get('profiles', {}).get(self.profile_name, {}).get('last_updated')
+
+    def get_search_index(self):
+        index = search_index.get_cached(self.user_id, self.profile_name, self.get_version())
+        if index is None:
+            transactions, _ = self.get_data()
+            index = search_index.build(self.user_id, self.profile_name, self.version, transactions)
+        return index
+
+    def get_transactions_paginated(self, page=1, limit=20, filters=None, include_archived=False):
         if filters is None:
             filters = {}
-            
-        transactions, _ = self.get_data()
-        
-        filtered_transactions = []
-        for t in transactions:
-            try:
-                t_date_str = t.get('date', '')
-                if not t_date_str:
-                    continue 
-                    
-                t_date = datetime.fromisoformat(t_date_str.replace('Z', '+00:00')).date()
-                
-                if filters.get('date_from'):
-                    from_date = datetime.fromisoformat(filters['date_from']).date()
-                    if t_date < from_date:
-                        continue
-                if filters.get('date_to'):
-                    to_date = datetime.fromisoformat(filters['date_to']).date()
-                    if t_date > to_date:
-                        continue
-            except (ValueError, TypeError) as e:
-                print(f"Skipping date filter for transaction {t.get('id')}: {e}")
-                pass 
-
-            if filters.get('source') and filters['source'] != t.get('source'):
-                continue
-            
-            search_term = filters.get('search', '').lower()
-            if search_term:
-                source_match = t.get('source', '').lower().find(search_term) != -1
-                amount_match = str(t.get('amount', '')).find(search_term) != -1
-                if not source_match and not amount_match:
-                    continue
-            
-            filtered_transactions.append(t)
 
-        sorted_transactions = sorted(filtered_transactions, key=lambda x: x.get('date', ''), reverse=True)
-        
-        total_earned_in_range = sum(t['amount'] for t in filtered_transactions if t['amount'] > 0)
-        total_spent_in_range = sum(t['amount'] for t in filtered_transactions if t['amount'] < 0)
+        if include_archived and self.doc_ref:
+            # Archived months are only loaded on request, and only those the
+            # date filter can match; the index for them isn't cached.
+            transactions, _ = self.get_data()
+            index = search_index.TransactionIndex(
+                transactions + self.get_archived_transactions(filters.get('date_from'), filters.get('date_to'),
+                                                              exclude_ids={t['id'] for t in transactions})
+            )
+        else:
+            index = self.get_search_index()
+        result = index.query(filters, page, limit)
 
-        total_transactions = len(sorted_transactions)
+        total_transactions = result['total_transactions']
         total_pages = (total_transactions + limit - 1) // limit 
         
-        start_index = (page - 1) * limit
-        end_index = start_index + limit
-        
-        paginated_txns = sorted_transactions[start_index:end_index]
-        
         return {
-            'transactions': paginated_txns,
+            'transactions': result['transactions'],
             'total_pages': total_pages,
             'current_page': page,
             'total_transactions': total_transactions,
-            'total_earned': total_earned_in_range,
-            'total_spent': total_spent_in_range,
+            'total_earned': result['total_earned'],
+            'total_spent': result['total_spent'],
         }
 
 
@@ -304,34 +327,44 @@ class WebCoinTracker:
             settings['quick_actions'] = self.get_default_settings()['quick_actions']
         return transactions, settings
 
-    def save_data(self, transactions, settings):
-        transactions = self.recalculate_balances(transactions)
+    def save_data(self, transactions, settings=None, added=(), removed=(), compact=True):
+        # settings=None leaves the stored settings alone; transaction writes
+        # never touch them. added/removed are the changed rows, if known.
+        # compact=False leaves compaction for the caller to schedule.
+        transactions = self.recalculate_balances(transactions, archive.archived_balance(self.snapshots))
+        self.forecast = self.updated_forecast(transactions, added, removed)
+        old_version, last_updated = self.version, dt_now_iso()
         if self.doc_ref:
             try:
-                doc = self.doc_ref.get()
-                data_to_save = {}
-                if doc.exists and doc.to_dict() is not None:
-                    data_to_save = doc.to_dict()
-
-                profiles_data = data_to_save.get('profiles', {})
-                
-                profiles_data[self.profile_name] = {
-                    'transactions': transactions, 
-                    'settings': settings, 
-                    'last_updated': dt_now_iso()
-                }
-                
+                # merge=True only replaces this profile's map, so the rest of the
+                # document doesn't need to be read first. Old-shape documents are
+                # cleaned up by the migrate_legacy_data job. Snapshots are written
+                # back with the transactions they were read with, so the pair
+                # stays consistent if compaction ran in between.
                 final_data = {
-                    'profiles': profiles_data,
-                    'last_active_profile': self.profile_name
+                    'profiles': {
+                        self.profile_name: {
+                            'transactions': transactions, 
+                            'snapshots': self.snapshots,
+                            'forecast': self.forecast,
+                            'last_updated': last_updated
+                        }
+                    }
                 }
                 
-                if 'transactions' in data_to_save:
-                    final_data['transactions'] = firestore.DELETE_FIELD
-                if 'settings' in data_to_save:
-                    final_data['settings'] = firestore.DELETE_FIELD
-                
-                self.doc_ref.set(final_data, merge=True) 
+                if settings is not None:
+                    self.save_settings(settings)
+                # The directory entry is committed with the data it describes.
+                batch = self.db.batch()
+                batch.set(self.doc_ref, final_data, merge=True)
+                batch.set(profile_directory_ref(self.user_id), {
+                    'profiles': {self.profile_name: self.directory_entry(transactions, last_updated)},
+                    'last_active_profile': self.profile_name
+                }, merge=True)
+                batch.commit()
+                self.after_save(old_version, last_updated, transactions, added, removed)
+                if compact:
+                    self.schedule_compaction(transactions)
                 
                 return True
             except Exception as e:
@@ -339,10 +372,39 @@ class WebCoinTracker:
                 return False
         else:
             profiles = session.get('profiles', {})
-            profiles[self.profile_name] = {'transactions': transactions, 'settings': settings, 'last_updated': dt_now_iso()}
+            if settings is None:
+                settings = profiles.get(self.profile_name, {}).get('settings', {})
+            profiles[self.profile_name] = {'transactions': transactions, 'settings': settings, 'snapshots': self.snapshots,
+                                           'forecast': self.forecast, 'last_updated': last_updated}
             session['profiles'] = profiles
             session.modified = True
+            self.after_save(old_version, last_updated, transactions, added, removed)
             return True
+
+    def updated_forecast(self, transactions, added, removed):
+        if added or removed:
+            try:
+                return forecast.apply(self.forecast, added, removed)
+            except forecast.RebuildNeeded:
+                pass
+        return forecast.build(transactions, archive.totals(self.snapshots) if self.snapshots else None)
+
+    def directory_entry(self, transactions, last_updated):
+        entry = {
+            'updated_at': last_updated,
+            'transaction_count': len(transactions) + sum(s.get('count', 0) for s in self.snapshots),
+            'balance': archive.archived_balance(self.snapshots) + sum(t.get('amount', 0) for t in transactions)
+        }
+        if self.version is None:
+            # Nothing was stored for this profile when it was read.
+            entry['created_at'] = last_updated
+        return entry
+
+    def after_save(self, old_version, new_version, transactions, added, removed):
+        self.version = new_version
+        read_flight.forget((self.user_id, self.profile_name))
+        search_index.apply_write(self.user_id, self.profile_name, old_version, new_version,
+                                 added=added, removed=[t['id'] for t in removed], rows=transactions)
             
     def import_data(self, data):
         print(f"Importing data for user {self.user_id}...")
@@ -350,11 +412,21 @@ class WebCoinTracker:
         settings = data.get('settings', self.get_default_settings())
         
         valid_transactions, valid_settings = self.validate_data(transactions, settings)
-        return self.save_data(valid_transactions, valid_settings)
+        # An import replaces the whole profile, archived months included.
+        self.snapshots = []
+        self.forecast = None
+        # Compaction waits until the old archive is gone; queued any earlier,
+        # it could archive imported rows that clear_archive() then deletes.
+        if not self.save_data(valid_transactions, valid_settings, compact=False):
+            return False
+        if self.doc_ref:
+            self.clear_archive()
+            self.schedule_compaction(sorted(valid_transactions, key=lambda t: t.get('date', '')))
+        return True
 
-    def recalculate_balances(self, transactions):
+    def recalculate_balances(self, transactions, opening_balance=0):
         sorted_transactions = sorted(transactions, key=lambda x: x.get('date', ''))
-        balance = 0
+        balance = opening_balance
         for t in sorted_transactions:
             t['previous_balance'] = balance
             balance += t.get('amount', 0)
@@ -362,47 +434,589 @@ class WebCoinTracker:
 
     def add_transaction(self, amount, source, date):
         transactions, settings = self.get_data()
-        transactions.append({"id": str(uuid.uuid4()), "date": date or dt_now_iso(), "amount": int(amount), "source": source})
-        return self.save_data(transactions, settings)
+        new_transaction = {"id": str(uuid.uuid4()), "date": date or dt_now_iso(), "amount": int(amount), "source": source}
+        transactions.append(new_transaction)
+        return self.save_data(transactions, added=[new_transaction])
 
     def update_transaction(self, transaction_id, new_data):
         transactions, settings = self.get_data()
         for t in transactions:
             if t.get('id') == transaction_id:
+                old = dict(t)
                 t.update({'amount': int(new_data['amount']), 'source': new_data['source'], 'date': new_data['date']})
-                return self.save_data(transactions, settings)
+                return self.save_data(transactions, added=[t], removed=[old])
         return False
 
     def delete_transaction(self, transaction_id):
         transactions, settings = self.get_data()
-        initial_len = len(transactions)
+        removed = [t for t in transactions if t.get('id') == transaction_id]
         transactions = [t for t in transactions if t.get('id') != transaction_id]
-        if len(transactions) < initial_len:
-            return self.save_data(transactions, settings)
+        if removed:
+            return self.save_data(transactions, removed=removed)
         return False
 
-    def get_profiles(self):
-        profiles = ['Default']
+    # --- Settings ---
+
+    def save_settings(self, settings):
+        # Replaces the whole settings document (imports, new profiles).
+        settings = {k: v for k, v in settings.items() if k not in ('firebase_available', 'all_sources')}
+        settings['updated_at'] = dt_now_iso()
+        self.settings_ref().set(settings)
+        self.settings_version = settings['updated_at']
+
+    def get_settings(self):
+        if self.doc_ref:
+            try:
+                doc = self.settings_ref().get()
+                if doc.exists:
+                    settings = self.get_default_settings()
+                    stored_settings = doc.to_dict() or {}
+                    self.settings_version = stored_settings.pop('updated_at', None)
+                    settings.update(stored_settings)
+                    return settings
+            except Exception as e:
+                print(f"Firebase settings load error for user {self.user_id}: {e}")
+        _, settings = self.get_data()
+        return settings
+
+    def write_settings(self, field_updates, option=None):
+        # With a write option (precondition), FailedPrecondition is raised so
+        # the caller can re-read and retry.
+        updated_at = dt_now_iso()
+        field_updates['updated_at'] = updated_at
+        try:
+            try:
+                self.settings_ref().update(field_updates, option=option)
+            except storage.NotFound:
+                # First change since settings were split out: copy the
+                # embedded settings over, then drop the embedded copy. A
+                # profile that was never saved has no embedded copy (and
+                # possibly no user_data document to update).
+                _, settings = self.get_data()
+                self.save_settings(settings)
+                self.settings_ref().update(field_updates)
+                if self.version is not None:
+                    self.doc_ref.update({storage.FieldPath('profiles', self.profile_name, 'settings').to_api_repr(): storage.DELETE_FIELD})
+        except storage.FailedPrecondition:
+            if option is not None:
+                raise
+            print("Firebase settings save error: settings changed during the write")
+            return False
+        except Exception as e:
+            print(f"Firebase settings save error: {e}")
+            return False
+        self.settings_version = updated_at
+        read_flight.forget((self.user_id, self.profile_name))
+        return True
+
+    def update_settings(self, changes):
+        if not self.doc_ref:
+            transactions, settings = self.get_data()
+            settings.update(changes)
+            return self.save_data(transactions, settings)
+        return self.write_settings({storage.FieldPath(key).to_api_repr(): value for key, value in changes.items()})
+
+    def add_quick_action(self, action):
+        if not self.doc_ref:
+            transactions, settings = self.get_data()
+            settings['quick_actions'].append(action)
+            return self.save_data(transactions, settings)
+        return self.write_settings({'quick_actions': storage.ArrayUnion([action])})
+
+    def delete_quick_action(self, index):
+        # Raises IndexError for an index outside the list and SettingsConflict
+        # if concurrent changes outlast the retries; False means the write failed.
+        if not self.doc_ref:
+            transactions, settings = self.get_data()
+            if not 0 <= index < len(settings['quick_actions']):
+                raise IndexError(index)
+            settings['quick_actions'].pop(index)
+            return self.save_data(transactions, settings)
+        # Rewrite the list rather than ArrayRemove, which would drop every
+        # identical copy of the action. The precondition keeps a concurrent
+        # change from being overwritten.
+        for _ in range(3):
+            doc = self.settings_ref().get()
+            if not doc.exists:
+                break
+            quick_actions = (doc.to_dict() or {}).get('quick_actions', self.get_default_settings()['quick_actions'])
+            if not 0 <= index < len(quick_actions):
+                raise IndexError(index)
+            quick_actions.pop(index)
+            try:
+                return self.write_settings({'quick_actions': quick_actions},
+                                           option=self.db.write_option(last_update_time=doc.update_time))
+            except storage.FailedPrecondition:
+                continue
+        else:
+            raise SettingsConflict('Quick actions changed during every attempt')
+        # No settings document yet: write_settings creates it.
+        quick_actions = self.get_settings()['quick_actions']
+        if not 0 <= index < len(quick_actions):
+            raise IndexError(index)
+        quick_actions.pop(index)
+        return self.write_settings({'quick_actions': quick_actions})
+
+    # --- Archive ---
+
+    def archive_ref(self):
+        return self.doc_ref.collection('archives').document(archive.profile_key(self.profile_name))
+
+    def schedule_compaction(self, transactions):
+        # Saved transactions are sorted by date, so the first one is the oldest.
+        if not (self.doc_ref and transactions and archive.is_archivable(transactions[0], archive.cutoff_month())):
+            return
+        key, now = (self.user_id, self.profile_name), time.monotonic()
+        with compaction_requested_lock:
+            if now - compaction_requested.get(key, float('-inf')) < COMPACTION_REQUEST_INTERVAL:
+                return
+            for stale in [k for k, t in compaction_requested.items() if now - t >= COMPACTION_REQUEST_INTERVAL]:
+                del compaction_requested[stale]
+            compaction_requested[key] = now
+        jobs.enqueue('compact_profile', {'user_id': self.user_id, 'profile': self.profile_name},
+                     created_by=self.user_id, dedupe_key=f"compact_profile:{self.user_id}:{self.profile_name}")
+
+    def compact(self):
+        doc = self.doc_ref.get()
+        data = (doc.to_dict() or {}) if doc.exists else {}
+        profile_data = data.get('profiles', {}).get(self.profile_name)
+        if not profile_data:
+            return {'archived': 0, 'months': 0}
+
+        cutoff = archive.cutoff_month()
+        to_archive = defaultdict(list)
+        hot = []
+        for t in profile_data.get('transactions', []):
+            if archive.is_archivable(t, cutoff):
+                to_archive[t['date'][:7]].append(t)
+            else:
+                hot.append(t)
+        if not to_archive:
+            return {'archived': 0, 'months': 0}
+
+        # Archive documents are written first. If the profile update below
+        # loses a race, the job retries and merge_month de-duplicates by id.
+        snapshots = {snap['month']: snap for snap in profile_data.get('snapshots', [])}
+        months_ref = self.archive_ref().collection('months')
+        for month, rows in to_archive.items():
+            month_doc = months_ref.document(month).get()
+            existing = archive.unpack(month_doc.to_dict().get('data')) if month_doc.exists else []
+            rows = archive.merge_month(existing, rows)
+            months_ref.document(month).set({
+                'month': month,
+                'count': len(rows),
+                'data': archive.pack(rows),
+                'updated_at': dt_now_iso()
+            })
+            snapshots[month] = archive.summarize_month(month, rows)
+
+        self.snapshots = archive.with_closing_balances(snapshots.values())
+        hot = self.recalculate_balances(hot, archive.archived_balance(self.snapshots))
+        last_updated = dt_now_iso()
+        profile_field = lambda field: storage.FieldPath('profiles', self.profile_name, field).to_api_repr()
+        self.doc_ref.update({
+            profile_field('transactions'): hot,
+            profile_field('snapshots'): self.snapshots,
+            profile_field('last_updated'): last_updated,
+        }, option=self.db.write_option(last_update_time=doc.update_time))
+
+        self.archive_ref().set({
+            'profile': self.profile_name,
+            'months': len(self.snapshots),
+            'count': sum(snap['count'] for snap in self.snapshots),
+            'updated_at': last_updated
+        })
+        self.version = last_updated
+        read_flight.forget((self.user_id, self.profile_name))
+        search_index.invalidate(self.user_id, self.profile_name)
+        return {'archived': sum(len(rows) for rows in to_archive.values()), 'months': len(to_archive)}
+
+    def get_archived_transactions(self, date_from=None, date_to=None, exclude_ids=()):
+        # Needs self.snapshots, i.e. call after get_data().
+        if not self.doc_ref or not self.snapshots:
+            return []
+
+        opening_balances, balance = {}, 0
+        for snap in self.snapshots:
+            opening_balances[snap['month']] = balance
+            balance = snap['closing_balance']
+
+        query = self.archive_ref().collection('months')
+        if date_from:
+            query = query.where('month', '>=', date_from[:7])
+        if date_to:
+            query = query.where('month', '<=', date_to[:7])
+
+        rows = []
+        for month_doc in query.stream():
+            month_data = month_doc.to_dict()
+            balance = opening_balances.get(month_data['month'], 0)
+            for t in archive.unpack(month_data.get('data')):
+                t['previous_balance'] = balance
+                balance += t.get('amount', 0)
+                if t.get('id') not in exclude_ids:
+                    t['archived'] = True
+                    rows.append(t)
+        return rows
+
+    def clear_archive(self):
+        archive_doc = self.archive_ref()
+        for month_doc in archive_doc.collection('months').list_documents():
+            month_doc.delete()
+        archive_doc.delete()
+
+    def get_profile_directory(self):
         if self.doc_ref:
             try:
-                doc = self.doc_ref.get()
-                if doc.exists and doc.to_dict() is not None: 
-                    profiles.extend([p for p in doc.to_dict().get('profiles', {}).keys() if p != 'Default'])
+                return read_profile_directory(self.user_id)
             except Exception as e: print(f"Firebase profiles error: {e}")
+        return {}
+
+    def get_profiles(self, directory=None):
+        profiles = ['Default']
+        if directory is None:
+            directory = self.get_profile_directory()
+        profiles.extend(directory.get('profiles', {}).keys())
         profiles.extend([p for p in session.get('profiles', {}).keys() if p not in profiles])
         return sorted(list(set(profiles)))
 
+# --- Profile Directory ---
+# user_data/{user_id}/meta/profiles lists a user's profiles with their counts,
+# balances and timestamps, plus the last active profile. It is written in the
+# same batch as every profile save, so listing, switching and login never have
+# to load the transaction document.
+
+def profile_directory_ref(user_id):
+    return db.collection('user_data').document(user_id).collection('meta').document('profiles')
+
+def build_profile_directory(user_id):
+    """(Re)create the directory from the full user_data document. Runs once
+    for users whose data predates the directory. The write only succeeds if
+    the directory hasn't changed since it was read, so an entry written by a
+    concurrent save is never replaced with one built from older data."""
+    directory_ref = profile_directory_ref(user_id)
+    for _ in range(3):
+        current = directory_ref.get()
+        doc = db.collection('user_data').document(user_id).get()
+        data = (doc.to_dict() or {}) if doc.exists else {}
+
+        stored_profiles = data.get('profiles', {})
+        if not stored_profiles and 'transactions' in data:
+            # Old single-profile shape; migrate_legacy_data moves it to Default.
+            stored_profiles = {'Default': {'transactions': data.get('transactions', [])}}
+
+        profiles = {}
+        for name, profile in stored_profiles.items():
+            txns = profile.get('transactions', [])
+            snapshots = profile.get('snapshots', [])
+            last_updated = profile.get('last_updated', 'N/A')
+            profiles[name] = {
+                'created_at': last_updated,
+                'updated_at': last_updated,
+                'transaction_count': len(txns) + sum(s.get('count', 0) for s in snapshots),
+                'balance': archive.archived_balance(snapshots) + sum(t.get('amount', 0) for t in txns)
+            }
+
+        current_data = (current.to_dict() or {}) if current.exists else {}
+        directory = {
+            'profiles': profiles,
+            'last_active_profile': current_data.get('last_active_profile') or data.get('last_active_profile', 'Default'),
+            'built_at': dt_now_iso()
+        }
+        try:
+            if current.exists:
+                directory_ref.update(directory, option=db.write_option(last_update_time=current.update_time))
+            else:
+                directory_ref.create(directory)
+            return directory
+        except (storage.FailedPrecondition, storage.AlreadyExists):
+            continue
+    # Still changing under us; the next read tries again.
+    print(f"Profile directory rebuild for user {user_id} gave up after repeated conflicts")
+    return directory
+
+def read_profile_directory(user_id):
+    doc = profile_directory_ref(user_id).get()
+    directory = (doc.to_dict() or {}) if doc.exists else {}
+    # A save can create the document before it was ever built; such a
+    # directory only lists the profiles written since.
+    if directory.get('built_at'):
+        return directory
+    return build_profile_directory(user_id)
+
+def set_last_active_profile(user_id, profile_name):
+    profile_directory_ref(user_id).set({'last_active_profile': profile_name}, merge=True)
+
+# --- Admin Rollup ---
+# The admin panel reads precomputed totals instead of scanning every user's
+# transactions per request. The rollup is rebuilt by a background job when it
+# gets older than ADMIN_ROLLUP_MAX_AGE.
+
+def summarize_user_data(doc_data):
+    user_balance = 0
+    user_txn_count = 0
+    last_updated = 'N/A'
+
+    if 'profiles' in doc_data:
+        for profile in doc_data.get('profiles', {}).values():
+            txns = profile.get('transactions', [])
+            snapshots = profile.get('snapshots', [])
+            user_txn_count += len(txns) + sum(snap.get('count', 0) for snap in snapshots)
+            user_balance += archive.archived_balance(snapshots)
+            for t in txns:
+                user_balance += t.get('amount', 0)
+
+            profile_last_updated = profile.get('last_updated')
+            if profile_last_updated:
+                if last_updated == 'N/A' or profile_last_updated > last_updated:
+                    last_updated = profile_last_updated
+
+    elif 'transactions' in doc_data:
+        txns = doc_data.get('transactions', [])
+        user_txn_count = len(txns)
+        for t in txns:
+            user_balance += t.get('amount', 0)
+
+    return user_balance, user_txn_count, last_updated
+
+def build_admin_rollup():
+    users_dict = {}
+    signups_by_day = defaultdict(int)
+    for user in db.collection('users').stream():
+        user_data = user.to_dict() or {}
+        users_dict[user.id] = {
+            'user_id': user.id,
+            'username': user_data.get('username', 'N/A'),
+            'username_lower': user_data.get('username_lower', ''),
+            'created_at': user_data.get('created_at', 'N/A'),
+            'balance': 0,
+            'last_updated': 'N/A',
+            'txn_count': 0
+        }
+        try:
+            created_at_str = user_data.get('created_at')
+            if '+' in created_at_str or 'Z' in created_at_str:
+                day = datetime.fromisoformat(created_at_str).strftime('%Y-%m-%d')
+            else:
+                day = datetime.fromisoformat(created_at_str + '+00:00').strftime('%Y-%m-%d')
+            signups_by_day[day] += 1
+        except Exception:
+            pass
+
+    total_coins = 0
+    total_transactions = 0
+    for user_data_doc in db.collection('user_data').stream():
+        doc_data = user_data_doc.to_dict()
+        if doc_data is None:
+            continue
+
+        user_balance, user_txn_count, last_updated = summarize_user_data(doc_data)
+        total_coins += user_balance
+        total_transactions += user_txn_count
+
+        if user_data_doc.id in users_dict:
+            users_dict[user_data_doc.id].update({
+                'balance': user_balance,
+                'txn_count': user_txn_count,
+                'last_updated': last_updated
+            })
+
+    rollup_ref = db.collection('admin_user_rollup')
+    stale_ids = [doc.id for doc in rollup_ref.stream() if doc.id not in users_dict]
+    batch = db.batch()
+    pending = 0
+    for user_id in stale_ids:
+        batch.delete(rollup_ref.document(user_id))
+        pending += 1
+    for user_id, row in users_dict.items():
+        batch.set(rollup_ref.document(user_id), row)
+        pending += 1
+        if pending >= 400:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+
+    rollup = {
+        'stats': {
+            'total_users': len(users_dict),
+            'total_coins': total_coins,
+            'total_transactions': total_transactions
+        },
+        'signups_by_day': dict(signups_by_day),
+        'built_at': dt_now_iso()
+    }
+    db.collection('app_config').document('admin_rollup').set(rollup)
+    return rollup['stats']
+
+def read_admin_rollup():
+    doc = db.collection('app_config').document('admin_rollup').get()
+    return doc.to_dict() if doc.exists else None
+
+def read_admin_user_rows():
+    users = []
+    for row in db.collection('admin_user_rollup').order_by('username_lower').stream():
+        user = row.to_dict()
+        user.pop('username_lower', None)
+        users.append(user)
+    return users
+
+def get_admin_rollup():
+    rollup = admin_flight.do('admin_rollup', read_admin_rollup)
+
+    job_id = None
+    if rollup is None or datetime.now(timezone.utc) - datetime.fromisoformat(rollup['built_at']) > ADMIN_ROLLUP_MAX_AGE:
+        job_id = jobs.enqueue('rebuild_admin_rollup', created_by=session.get('user_id'),
+                              dedupe_key='rebuild_admin_rollup')
+    return rollup, job_id
+
+def delete_user_data(user_id):
+    db.collection('users').document(user_id).delete()
+    user_data_ref = db.collection('user_data').document(user_id)
+    for settings_doc in user_data_ref.collection('settings').list_documents():
+        settings_doc.delete()
+    for meta_doc in user_data_ref.collection('meta').list_documents():
+        meta_doc.delete()
+    for archive_doc in user_data_ref.collection('archives').list_documents():
+        for month_doc in archive_doc.collection('months').list_documents():
+            month_doc.delete()
+        archive_doc.delete()
+    user_data_ref.delete()
+    db.collection('admin_user_rollup').document(user_id).delete()
+
+def public_job(job):
+    # Payloads can hold whole imports; status callers only need the outcome.
+    return {k: v for k, v in job.items() if k not in ('payload', 'dedupe_key')}
+
+# --- Background Jobs ---
+
+@jobs.task('rebuild_admin_rollup', max_running=1)
+def rebuild_admin_rollup_job(payload):
+    return build_admin_rollup()
+
+@jobs.task('import_data')
+def import_data_job(payload):
+    tracker = WebCoinTracker(payload['profile'], payload['user_id'])
+    if not tracker.import_data(payload['data']):
+        raise RuntimeError('Failed to save imported data')
+    return {'profile': payload['profile'], 'transactions': len(payload['data'].get('transactions', []))}
+
+@jobs.task('migrate_legacy_data')
+def migrate_legacy_data_job(payload):
+    user_id = payload['user_id']
+    doc_ref = db.collection('user_data').document(user_id)
+    doc = doc_ref.get()
+    data = (doc.to_dict() or {}) if doc.exists else {}
+    if 'transactions' not in data and 'settings' not in data:
+        return {'migrated': False}
+
+    update = {}
+    if 'transactions' in data:
+        update['transactions'] = storage.DELETE_FIELD
+    if 'settings' in data:
+        update['settings'] = storage.DELETE_FIELD
+
+    # If the user already saved under the new shape, that copy is newer.
+    if 'Default' not in data.get('profiles', {}):
+        tracker = WebCoinTracker('Default', user_id)
+        settings = tracker.get_default_settings()
+        settings.update(data.get('settings', {}))
+        transactions, settings = tracker.validate_data(data.get('transactions', []), settings)
+        update[storage.FieldPath('profiles', 'Default').to_api_repr()] = {
+            'transactions': tracker.recalculate_balances(transactions),
+            'settings': settings,
+            'last_updated': dt_now_iso()
+        }
+
+    # Fails if a save landed since the read (e.g. one that created
+    # profiles.Default); the job is retried and re-reads.
+    doc_ref.update(update, option=db.write_option(last_update_time=doc.update_time))
+    build_profile_directory(user_id)
+    return {'migrated': True}
+
+@jobs.task('compact_profile')
+def compact_profile_job(payload):
+    return WebCoinTracker(payload['profile'], payload['user_id']).compact()
+
+@jobs.task('backtest_forecasts', max_running=1)
+def backtest_forecasts_job(payload):
+    # Replays full histories, archived months included, so it reads far
+    # more than any request does. Reads the stored documents directly:
+    # get_data() and read_profile_directory() may write or queue jobs.
+    horizons = [int(h) for h in payload.get('horizons') or (7, 30)]
+    if payload.get('user_id'):
+        user_docs = [db.collection('user_data').document(payload['user_id']).get()]
+    else:
+        user_docs = db.collection('user_data').stream()
+
+    reports = []
+    for user_doc in user_docs:
+        if not user_doc.exists:
+            continue
+        # Old-shape documents have no profiles map until they're migrated.
+        profiles = (user_doc.to_dict() or {}).get('profiles', {})
+        profile_names = [payload['profile']] if payload.get('profile') else list(profiles)
+        for profile_name in profile_names:
+            if profile_name not in profiles:
+                continue
+            history = read_profile_history(user_doc.reference, profile_name, profiles[profile_name])
+            report = forecast.backtest(forecast.daily_totals(history), horizons)
+            if report:
+                reports.append(report)
+    return {'profiles': len(reports), 'horizons': forecast.combine_backtests(reports)}
+
+def read_profile_history(user_data_ref, profile_name, profile_data):
+    """Every transaction of a stored profile, archived months included."""
+    transactions = list(profile_data.get('transactions', []))
+    if profile_data.get('snapshots'):
+        hot_ids = {t.get('id') for t in transactions}
+        months = user_data_ref.collection('archives').document(archive.profile_key(profile_name)).collection('months')
+        for month_doc in months.stream():
+            transactions.extend(t for t in archive.unpack((month_doc.to_dict() or {}).get('data'))
+                                if t.get('id') not in hot_ids)
+    return transactions
+
+@jobs.task('delete_user')
+def delete_user_job(payload):
+    delete_user_data(payload['user_id'])
+    jobs.enqueue('rebuild_admin_rollup', dedupe_key='rebuild_admin_rollup')
+    return {'user_id': payload['user_id']}
+
+@bp.before_app_request
+def start_job_workers():
+    if db:
+        jobs.start()
+
+# The memory store counts operations per thread (per greenlet under gevent);
+# load tests read each request's count from the X-Storage-Ops header.
+@bp.before_app_request
+def reset_storage_ops():
+    if storage.STORAGE_BACKEND == 'memory' and db:
+        db.reset_ops()
+
+@bp.after_app_request
+def report_storage_ops(response):
+    if storage.STORAGE_BACKEND == 'memory' and db:
+        response.headers['X-Storage-Ops'] = f"reads={db.ops.reads} writes={db.ops.writes}"
+    return response
+
 # --- Auth Routes ---
 
-@app.route('/login')
+@bp.route('/login')
 def login():
     if 'user_id' in session:
         if session.get('role') == 'admin':
-            return redirect(url_for('admin_panel'))
-        return redirect(url_for('index'))
+            return redirect(url_for('coin.admin_panel'))
+        return redirect(url_for('coin.index'))
     return render_template('login.html')
 
-@app.route('/api/register', methods=['POST'])
+def hashing_busy_response():
+    response = jsonify({'success': False, 'error': 'Server is busy, please try again in a moment'})
+    response.headers['Retry-After'] = '2'
+    return response, 503
+
+@bp.route('/api/register', methods=['POST'])
 def register():
     if not db:
         return jsonify({'success': False, 'error': 'Database not available'}), 500
@@ -420,7 +1034,10 @@ def register():
         return jsonify({'success': False, 'error': 'Username already exists'}), 409
         
     user_id = str(uuid.uuid4())
-    hashed_password = generate_password_hash(password)
+    try:
+        hashed_password = hash_password(password)
+    except HashingBusy:
+        return hashing_busy_response()
     users_ref.document(user_id).set({
         'username': username,
         'username_lower': username_lower,
@@ -428,9 +1045,20 @@ def register():
         'created_at': dt_now_iso(),
         'role': 'user'
     })
+    try:
+        db.collection('admin_user_rollup').document(user_id).set({
+            'user_id': user_id,
+            'username': username,
+            'username_lower': username_lower,
+            'created_at': dt_now_iso(),
+            'balance': 0,
+            'last_updated': 'N/A',
+            'txn_count': 0
+        })
+    except Exception as e: print(f"Error adding admin rollup row: {e}")
     return jsonify({'success': True})
 
-@app.route('/api/login', methods=['POST'])
+@bp.route('/api/login', methods=['POST'])
 def handle_login():
     if not db:
         return jsonify({'success': False, 'error': 'Database not available'}), 500
@@ -449,34 +1077,50 @@ def handle_login():
     user_doc = user_query[0]
     user_data = user_doc.to_dict()
     
-    if check_password_hash(user_data.get('password_hash'), password):
+    try:
+        password_ok = verify_password(user_data.get('password_hash'), password)
+    except HashingBusy:
+        return hashing_busy_response()
+
+    if password_ok:
+        if needs_rehash(user_data.get('password_hash')):
+            try:
+                users_ref.document(user_doc.id).update({'password_hash': hash_password(password)})
+            except Exception as e: print(f"Password rehash skipped for user {user_doc.id}: {e}")
+
         session.permanent = True
         session['user_id'] = user_doc.id
         session['username'] = user_data.get('username')
         session['role'] = user_data.get('role', 'user')
         
-        user_data_doc = db.collection('user_data').document(user_doc.id).get()
         last_profile = 'Default'
-        
-        if user_data_doc.exists and user_data_doc.to_dict() is not None:
-            last_profile = user_data_doc.to_dict().get('last_active_profile', 'Default')
+        try:
+            directory_doc = profile_directory_ref(user_doc.id).get(field_paths=['last_active_profile'])
+            if directory_doc.exists:
+                last_profile = directory_doc.get('last_active_profile') or 'Default'
+            else:
+                # Before the directory exists, read just this field.
+                user_data_doc = db.collection('user_data').document(user_doc.id).get(field_paths=['last_active_profile'])
+                if user_data_doc.exists:
+                    last_profile = user_data_doc.get('last_active_profile') or 'Default'
+        except Exception as e: print(f"Error loading last active profile: {e}")
         session['current_profile'] = last_profile
         
         if session['role'] == 'admin':
-            return jsonify({'success': True, 'username': session['username'], 'redirect': url_for('admin_panel')})
+            return jsonify({'success': True, 'username': session['username'], 'redirect': url_for('coin.admin_panel')})
             
-        return jsonify({'success': True, 'username': session['username'], 'redirect': url_for('index')})
+        return jsonify({'success': True, 'username': session['username'], 'redirect': url_for('coin.index')})
     else:
         return jsonify({'success': False, 'error': 'Invalid username or password'}), 401
 
 
-@app.route('/api/logout', methods=['POST'])
+@bp.route('/api/logout', methods=['POST'])
 @login_required
 def logout():
     session.clear()
     return jsonify({'success': True})
 
-@app.route('/api/user')
+@bp.route('/api/user')
 @login_required
 def get_user():
     return jsonify({
@@ -487,29 +1131,44 @@ def get_user():
 
 # --- Main App Route ---
 
-@app.route('/')
+@bp.route('/')
 @login_required
 def index():
     return render_template('index.html')
 
 # --- Main Data API Routes ---
 
-@app.route('/api/data')
+@bp.route('/api/data')
 @login_required
 def get_all_data():
     profile_name = session.get('current_profile', 'Default')
     user_id = session.get('user_id')
     tracker = WebCoinTracker(profile_name, user_id)
     
-    transactions, settings = tracker.get_data()
-    
-    balance = sum(t.get('amount', 0) for t in transactions)
+    transactions, settings = tracker.get_data_shared()
+    snapshots, forecast_state = tracker.snapshots, tracker.forecast
+
+    if tracker.doc_ref and tracker.version is not None:
+        payload = dashboard_flight.do(
+            (user_id, profile_name, tracker.version, tracker.settings_version),
+            lambda: build_dashboard(user_id, profile_name, tracker.version, transactions, settings, snapshots, forecast_state)
+        )
+    else:
+        payload = build_dashboard(user_id, profile_name, tracker.version, transactions, settings, snapshots, forecast_state)
+    return jsonify(payload)
+
+def build_dashboard(user_id, profile_name, version, transactions, settings, snapshots=(), forecast_state=None):
+    # transactions/settings may be shared with other requests; don't modify them.
+    # Archived months only contribute through their snapshots; the horizon
+    # keeps today/week/month stats entirely within the hot transactions.
+    settings = dict(settings)
+    archived = archive.totals(snapshots)
+    balance = archived['balance'] + sum(t.get('amount', 0) for t in transactions)
     goal = settings.get('goal', 13500)
     today, week_start, month_start = datetime.now().date(), datetime.now().date() - timedelta(days=datetime.now().weekday()), datetime.now().date().replace(day=1)
     
     today_earn, week_earn, month_earn = 0, 0, 0
-    total_earnings = 0
-    first_earning_date = None
+    total_earnings = archived['earned']
     
     for t in transactions:
         if t.get('amount', 0) > 0:
@@ -520,9 +1179,6 @@ def get_all_data():
 
                 if t_date_obj.tzinfo is None:
                     t_date_obj = t_date_obj.replace(tzinfo=timezone.utc)
-
-                if first_earning_date is None or t_date_obj < first_earning_date:
-                    first_earning_date = t_date_obj
                 
                 t_date_stats = t_date_obj.date()
                 if t_date_stats == today: today_earn += t['amount']
@@ -532,48 +1188,43 @@ def get_all_data():
             except (ValueError, TypeError):
                 pass
 
-    estimated_days = "N/A"
-    if total_earnings > 0 and first_earning_date is not None:
-        days_since_start = (datetime.now(timezone.utc) - first_earning_date).days
-        if days_since_start == 0:
-            days_since_start = 1
-        
-        avg_daily_earnings = total_earnings / days_since_start
-        amount_remaining = goal - balance
-        
-        if amount_remaining <= 0:
-            estimated_days = 0
-        elif avg_daily_earnings > 0:
-            estimated_days = int(amount_remaining / avg_daily_earnings)
+    # Profiles saved before forecasts existed get a state built on the fly;
+    # their next write stores one.
+    if not forecast.is_current(forecast_state):
+        forecast_state = forecast.build(transactions, archived if snapshots else None)
+    projection = forecast.summary(forecast_state, balance, goal)
             
-    total_spending = abs(sum(t['amount'] for t in transactions if t['amount'] < 0))
+    total_spending = archived['spent'] + abs(sum(t['amount'] for t in transactions if t['amount'] < 0))
     
-    earnings_breakdown = defaultdict(int)
+    earnings_breakdown = defaultdict(int, archived['earnings_by_source'])
     for t in transactions:
         if t['amount'] > 0: earnings_breakdown[t['source']] += t['amount']
         
-    spending_breakdown = defaultdict(int)
+    spending_breakdown = defaultdict(int, archived['spending_by_source'])
     for t in transactions:
         if t['amount'] < 0: spending_breakdown[t['source']] += abs(t['amount'])
         
-    timeline = [{'date': t['date'], 'balance': t.get('previous_balance', 0) + t.get('amount', 0)} for t in sorted(transactions, key=lambda x: x.get('date', ''))]
+    timeline = [{'date': snap['last_date'], 'balance': snap['closing_balance']} for snap in snapshots]
+    timeline += [{'date': t['date'], 'balance': t.get('previous_balance', 0) + t.get('amount', 0)} for t in sorted(transactions, key=lambda x: x.get('date', ''))]
 
-    settings['firebase_available'] = FIREBASE_AVAILABLE and db is not None
+    settings['firebase_available'] = bool(db)
     
-    all_sources = sorted(list(set(t['source'] for t in transactions)))
-    settings['all_sources'] = all_sources
+    index = search_index.get_or_build(user_id, profile_name, version, transactions)
+    settings['all_sources'] = sorted(set(index.all_sources()) | set(earnings_breakdown) | set(spending_breakdown))
 
-    achievements = calculate_achievements(transactions, balance, goal)
+    achievements = calculate_achievements(transactions, balance, goal, archived if snapshots else None)
 
-    return jsonify({
+    return {
         'profile': profile_name, 
         'transactions': transactions, 
         'settings': settings, 
         'balance': balance, 
         'goal': goal,
         'progress': min(100, int((balance / goal) * 100)) if goal > 0 else 0,
-        'estimated_days': estimated_days,
+        'estimated_days': projection['estimated_days'],
+        'forecast': projection,
         'dashboard_stats': {'today': today_earn, 'week': week_earn, 'month': month_earn},
+        'archived_count': archived['count'],
         'analytics': {
             'total_earnings': total_earnings, 
             'total_spending': total_spending, 
@@ -584,9 +1235,9 @@ def get_all_data():
         },
         'achievements': achievements,
         'success': True
-    })
+    }
     
-@app.route('/api/history')
+@bp.route('/api/history')
 @login_required
 def get_history_paginated():
     profile_name = session.get('current_profile', 'Default')
@@ -607,11 +1258,37 @@ def get_history_paginated():
         'source': request.args.get('source')
     }
     filters = {k: v for k, v in filters.items() if v}
+    include_archived = request.args.get('include_archived') in ('1', 'true')
         
-    data = tracker.get_transactions_paginated(page, limit, filters)
+    data = tracker.get_transactions_paginated(page, limit, filters, include_archived)
     return jsonify(data)
 
-@app.route('/api/add-transaction', methods=['POST'])
+@bp.route('/api/export-data')
+@login_required
+def handle_export_data():
+    tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
+    transactions, settings = tracker.get_data()
+    archived = tracker.get_archived_transactions(exclude_ids={t['id'] for t in transactions})
+    for t in archived:
+        t.pop('archived', None)
+    return jsonify({
+        'settings': settings,
+        'transactions': tracker.recalculate_balances(archived + transactions),
+        'success': True
+    })
+
+@bp.route('/api/sources')
+@login_required
+def get_source_suggestions():
+    tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
+    prefix = request.args.get('prefix', '')
+    try:
+        limit = min(int(request.args.get('limit', 10)), 50)
+    except ValueError:
+        limit = 10
+    return jsonify({'sources': tracker.get_search_index().sources_with_prefix(prefix, limit), 'success': True})
+
+@bp.route('/api/add-transaction', methods=['POST'])
 @login_required
 def handle_add_transaction():
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
@@ -620,7 +1297,7 @@ def handle_add_transaction():
         return get_all_data()
     return jsonify({'success': False, 'error': 'Failed to save transaction'}), 500
 
-@app.route('/api/update-transaction/<transaction_id>', methods=['POST'])
+@bp.route('/api/update-transaction/<transaction_id>', methods=['POST'])
 @login_required
 def handle_update_transaction(transaction_id):
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
@@ -628,7 +1305,7 @@ def handle_update_transaction(transaction_id):
         return get_all_data()
     return jsonify({'success': False, 'error': 'Failed to update'}), 404
 
-@app.route('/api/delete-transaction/<transaction_id>', methods=['POST'])
+@bp.route('/api/delete-transaction/<transaction_id>', methods=['POST'])
 @login_required
 def handle_delete_transaction(transaction_id):
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
@@ -636,238 +1313,184 @@ def handle_delete_transaction(transaction_id):
         return get_all_data()
     return jsonify({'success': False, 'error': 'Failed to delete'}), 404
 
-@app.route('/api/update-settings', methods=['POST'])
+@bp.route('/api/update-settings', methods=['POST'])
 @login_required
 def update_settings():
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
-    transactions, settings = tracker.get_data()
-    
-    settings.update(request.json)
     
-    if tracker.save_data(transactions, settings):
+    if tracker.update_settings(request.json):
         return get_all_data()
     return jsonify({'success': False, 'error': 'Failed to save settings'}), 500
     
-@app.route('/api/import-data', methods=['POST'])
+@bp.route('/api/import-data', methods=['POST'])
 @login_required
 def handle_import_data():
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
     data = request.json
+    if tracker.doc_ref:
+        job_id = jobs.enqueue('import_data', {
+            'user_id': tracker.user_id,
+            'profile': tracker.profile_name,
+            'data': data
+        }, created_by=tracker.user_id)
+        return jsonify({'success': True, 'job_id': job_id}), 202
     if tracker.import_data(data):
         return get_all_data()
     return jsonify({'success': False, 'error': 'Failed to import data'}), 500
 
-@app.route('/api/add-quick-action', methods=['POST'])
+@bp.route('/api/jobs/<job_id>')
+@login_required
+def get_own_job(job_id):
+    job = jobs.get_job(job_id)
+    if job is None or job.get('created_by') != session.get('user_id'):
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'job': public_job(job), 'success': True})
+
+@bp.route('/api/add-quick-action', methods=['POST'])
 @login_required
 def add_quick_action():
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
-    transactions, settings = tracker.get_data()
     
     new_action = request.json
     if 'text' in new_action and 'value' in new_action and 'is_positive' in new_action:
-        settings['quick_actions'].append(new_action)
-        if tracker.save_data(transactions, settings):
+        if tracker.add_quick_action(new_action):
             return get_all_data()
     
     return jsonify({'success': False, 'error': 'Invalid action data'}), 400
 
-@app.route('/api/delete-quick-action', methods=['POST'])
+@bp.route('/api/delete-quick-action', methods=['POST'])
 @login_required
 def delete_quick_action():
     tracker = WebCoinTracker(session.get('current_profile', 'Default'), session.get('user_id'))
-    transactions, settings = tracker.get_data()
     
     data = request.json
-    index_to_delete = data.get('index')
     
     try:
-        index_to_delete = int(index_to_delete)
-        if 0 <= index_to_delete < len(settings['quick_actions']):
-            settings['quick_actions'].pop(index_to_delete)
-            if tracker.save_data(transactions, settings):
-                return get_all_data()
-    except (TypeError, ValueError):
-        pass 
+        if tracker.delete_quick_action(int(data.get('index'))):
+            return get_all_data()
+    except (TypeError, ValueError, IndexError):
+        return jsonify({'success': False, 'error': 'Invalid index'}), 400
+    except SettingsConflict:
+        response = jsonify({'success': False, 'error': 'Settings are being changed elsewhere, please try again'})
+        response.headers['Retry-After'] = '1'
+        return response, 409
     
-    return jsonify({'success': False, 'error': 'Invalid index'}), 400
+    return jsonify({'success': False, 'error': 'Failed to save settings'}), 500
 
 # --- Profile Routes ---
-@app.route('/api/profiles')
+@bp.route('/api/profiles')
 @login_required
 def get_profiles():
     tracker = WebCoinTracker(user_id=session.get('user_id'))
-    return jsonify({'profiles': tracker.get_profiles(), 'current_profile': session.get('current_profile', 'Default')})
+    directory = tracker.get_profile_directory()
+    return jsonify({
+        'profiles': tracker.get_profiles(directory),
+        'details': directory.get('profiles', {}),
+        'current_profile': session.get('current_profile', 'Default')
+    })
 
-@app.route('/api/switch-profile', methods=['POST'])
+@bp.route('/api/switch-profile', methods=['POST'])
 @login_required
 def switch_profile():
     profile_name = request.json.get('profile_name')
     user_id = session.get('user_id')
     session['current_profile'] = profile_name
     
-    if db and FIREBASE_AVAILABLE:
+    if db:
         try:
-            db.collection('user_data').document(user_id).set({'last_active_profile': profile_name}, merge=True)
+            set_last_active_profile(user_id, profile_name)
         except Exception as e: print(f"Error saving last active profile: {e}")
             
     return jsonify({'success': True})
 
-@app.route('/api/create-profile', methods=['POST'])
+@bp.route('/api/create-profile', methods=['POST'])
 @login_required
 def create_profile():
     profile_name = request.json.get('profile_name')
     user_id = session.get('user_id')
     
     tracker = WebCoinTracker(profile_name, user_id)
-    if profile_name in tracker.get_profiles():
+    profiles = tracker.get_profiles()
+    if profile_name in profiles:
         return jsonify({'success': False, 'error': 'Profile already exists'}), 409
         
+    # save_data also records the new profile as the last active one.
     if tracker.save_data([], tracker.get_default_settings()):
         session['current_profile'] = profile_name
-        if db and FIREBASE_AVAILABLE:
-            try:
-                db.collection('user_data').document(user_id).set({'last_active_profile': profile_name}, merge=True)
-            except Exception as e: print(f"Error saving last active profile: {e}")
-        
         return jsonify({
             'success': True, 
-            'profiles': tracker.get_profiles(), 
+            'profiles': sorted(profiles + [profile_name]), 
             'current_profile': profile_name
         })
     return jsonify({'success': False, 'error': 'Failed to create profile'}), 500
 
 # --- Admin Routes ---
 
-@app.route('/admin')
+@bp.route('/admin')
 @login_required
 def admin_panel():
     if session.get('role') != 'admin':
-        return redirect(url_for('index'))
+        return redirect(url_for('coin.index'))
     return render_template('admin.html')
 
-@app.route('/api/admin/stats')
+@bp.route('/api/admin/stats')
 @admin_required
 def get_admin_stats():
-    total_users = len(list(db.collection('users').stream()))
-    
-    thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
-    users_query = db.collection('users').where('created_at', '>=', thirty_days_ago.isoformat()).stream()
-    
-    signups_by_day = defaultdict(int)
-    for user in users_query:
-        try:
-            created_at_str = user.to_dict().get('created_at')
-            if '+' in created_at_str or 'Z' in created_at_str:
-                day = datetime.fromisoformat(created_at_str).strftime('%Y-%m-%d')
-            else:
-                day = datetime.fromisoformat(created_at_str + '+00:00').strftime('%Y-%m-%d')
-            signups_by_day[day] += 1
-        except Exception:
-            pass 
+    rollup, job_id = get_admin_rollup()
+    stats = {'total_users': 0, 'total_coins': 0, 'total_transactions': 0}
+    signups_by_day = {}
+    if rollup:
+        stats = rollup.get('stats', stats)
+        signups_by_day = rollup.get('signups_by_day', {})
 
     chart_labels = []
     chart_data = []
     for i in range(30):
         day = (datetime.now(timezone.utc) - timedelta(days=i)).strftime('%Y-%m-%d')
         chart_labels.append(day)
-        chart_data.append(signups_by_day[day])
+        chart_data.append(signups_by_day.get(day, 0))
         
     chart_labels.reverse()
     chart_data.reverse()
 
-    total_coins = 0
-    total_transactions = 0
-    all_user_data = db.collection('user_data').stream()
-    for user_data_doc in all_user_data:
-        doc_data = user_data_doc.to_dict()
-        if doc_data is None:
-            continue
-            
-        profiles = doc_data.get('profiles', {})
-        
-        if profiles:
-            for profile in profiles.values():
-                txns = profile.get('transactions', [])
-                total_transactions += len(txns)
-                for t in txns:
-                    total_coins += t.get('amount', 0)
-        elif 'transactions' in doc_data:
-             txns = doc_data.get('transactions', [])
-             total_transactions += len(txns)
-             for t in txns:
-                total_coins += t.get('amount', 0)
-                
     return jsonify({
-        'stats': {
-            'total_users': total_users,
-            'total_coins': total_coins,
-            'total_transactions': total_transactions
-        },
+        'stats': stats,
         'chart_data': {
             'labels': chart_labels,
             'data': chart_data
         },
+        'built_at': rollup.get('built_at') if rollup else None,
+        'rollup_job_id': job_id,
         'success': True
     })
 
-@app.route('/api/admin/users')
+@bp.route('/api/admin/users')
 @admin_required
 def get_admin_users():
-    users_ref = db.collection('users')
-    data_ref = db.collection('user_data')
-    
-    users_query = users_ref.order_by('username_lower').stream()
-    users_dict = {}
-    for user in users_query:
-        user_data = user.to_dict()
-        users_dict[user.id] = {
-            'user_id': user.id,
-            'username': user_data.get('username', 'N/A'),
-            'created_at': user_data.get('created_at', 'N/A'),
-            'balance': 0,
-            'last_updated': 'N/A',
-            'txn_count': 0
-        }
-        
-    all_user_data = data_ref.stream()
-    for user_data_doc in all_user_data:
-        user_id = user_data_doc.id
-        if user_id in users_dict:
-            doc_data = user_data_doc.to_dict()
-            if doc_data is None:
-                continue
+    rollup, job_id = get_admin_rollup()
+    users = admin_flight.do('admin_user_rows', read_admin_user_rows) if rollup else []
 
-            user_balance = 0
-            user_txn_count = 0
-            last_updated = 'N/A'
-            
-            if 'profiles' in doc_data:
-                profiles = doc_data.get('profiles', {})
-                for profile in profiles.values():
-                    txns = profile.get('transactions', [])
-                    user_txn_count += len(txns)
-                    for t in txns:
-                        user_balance += t.get('amount', 0)
-                    
-                    profile_last_updated = profile.get('last_updated')
-                    if profile_last_updated:
-                        if last_updated == 'N/A' or profile_last_updated > last_updated:
-                            last_updated = profile_last_updated
-            
-            elif 'transactions' in doc_data:
-                txns = doc_data.get('transactions', [])
-                user_txn_count = len(txns)
-                for t in txns:
-                    user_balance += t.get('amount', 0)
+    return jsonify({'users': users, 'rollup_job_id': job_id, 'success': True})
 
-            users_dict[user_id]['balance'] = user_balance
-            users_dict[user_id]['txn_count'] = user_txn_count
-            users_dict[user_id]['last_updated'] = last_updated
+@bp.route('/api/admin/rebuild-rollup', methods=['POST'])
+@admin_required
+def rebuild_admin_rollup():
+    job_id = jobs.enqueue('rebuild_admin_rollup', created_by=session.get('user_id'),
+                          dedupe_key='rebuild_admin_rollup')
+    return jsonify({'success': True, 'job_id': job_id}), 202
 
-    return jsonify({'users': list(users_dict.values()), 'success': True})
 
+@bp.route('/api/admin/backtest-forecasts', methods=['POST'])
+@admin_required
+def backtest_forecasts():
+    data = request.get_json(silent=True) or {}
+    payload = {k: data[k] for k in ('user_id', 'profile', 'horizons') if data.get(k)}
+    job_id = jobs.enqueue('backtest_forecasts', payload, created_by=session.get('user_id'),
+                          dedupe_key=None if payload else 'backtest_forecasts')
+    return jsonify({'success': True, 'job_id': job_id}), 202
 
-@app.route('/api/admin/delete-user', methods=['POST'])
+
+@bp.route('/api/admin/delete-user', methods=['POST'])
 @admin_required
 def delete_admin_user():
     user_id = request.json.get('user_id')
@@ -875,15 +1498,33 @@ def delete_admin_user():
         return jsonify({'success': False, 'error': 'User ID required'}), 400
     
     try:
-        db.collection('users').document(user_id).delete()
-        db.collection('user_data').document(user_id).delete()
-        return jsonify({'success': True})
+        job_id = jobs.enqueue('delete_user', {'user_id': user_id}, created_by=session.get('user_id'),
+                              dedupe_key=f"delete_user:{user_id}")
+        return jsonify({'success': True, 'job_id': job_id}), 202
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@bp.route('/api/admin/jobs')
+@admin_required
+def get_admin_jobs():
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+    except ValueError:
+        limit = 50
+    job_list = jobs.list_jobs(request.args.get('status'), limit)
+    return jsonify({'jobs': [public_job(j) for j in job_list], 'success': True})
+
+@bp.route('/api/admin/jobs/<job_id>')
+@admin_required
+def get_admin_job(job_id):
+    job = jobs.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'job': public_job(job), 'success': True})
+
 # --- Broadcast Routes ---
 
-@app.route('/api/broadcast')
+@bp.route('/api/broadcast')
 @login_required 
 def get_broadcast():
     try:
@@ -894,7 +1535,7 @@ def get_broadcast():
     except Exception:
         return jsonify({'message': ''})
 
-@app.route('/api/admin/broadcast', methods=['POST'])
+@bp.route('/api/admin/broadcast', methods=['POST'])
 @admin_required
 def set_broadcast():
     message = request.json.get('message', '')
@@ -909,6 +1550,33 @@ def set_broadcast():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+# --- App Factory ---
+
+def create_app(config=None):
+    """Build the Flask app. Nothing here touches storage; the client is
+    created on the first request that needs it. With STORAGE_PRELOAD=1 the
+    backend's imports and credentials are loaded now, so gunicorn --preload
+    shares them across workers (each worker still connects after the fork)."""
+    app = Flask(__name__,
+        template_folder='templates',
+        static_folder='static'
+    )
+    app.secret_key = os.environ.get('SECRET_KEY', 'a-very-secret-key-for-dev')
+    app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
+    app.config['STORAGE_PRELOAD'] = os.environ.get('STORAGE_PRELOAD', '') == '1'
+    app.config.update(config or {})
+
+    if app.config.get('STORAGE_CLIENT') is not None:
+        storage.use(app.config['STORAGE_CLIENT'])
+    elif app.config['STORAGE_PRELOAD']:
+        storage.preload()
+
+    app.register_blueprint(bp)
+    return app
+
+# `gunicorn app:app` and `python app.py` keep working.
+app = create_app()
+
 # --- Main Entry Point ---
 
 if __name__ == '__main__':
@@ -0,0 +1,141 @@
+import os
+import json
+import zlib
+from urllib.parse import quote
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+# --- Transaction Archive ---
+# Transactions older than the horizon are moved out of the profile into
+# compressed per-month archive documents. Each archived month leaves behind a
+# small snapshot in the profile (totals, per-source sums, closing balance and
+# the few dates achievements need), so dashboard numbers stay exact while the
+# profile only holds recent history.
+#
+# Storage layout:
+#   user_data/{user_id}/archives/{profile_key}                  summary
+#   user_data/{user_id}/archives/{profile_key}/months/{YYYY-MM} month data
+
+# Must cover the longest window read from raw transactions (month-to-date
+# stats, so at least two months).
+ARCHIVE_HORIZON_DAYS = max(62, int(os.environ.get('ARCHIVE_HORIZON_DAYS', 180)))
+
+
+def cutoff_month(now=None):
+    """First month ('YYYY-MM') that stays hot. Whole months are archived."""
+    now = now or datetime.now(timezone.utc)
+    return (now - timedelta(days=ARCHIVE_HORIZON_DAYS)).strftime('%Y-%m')
+
+
+def is_archivable(t, cutoff):
+    # Dates that don't start with an ISO month compare greater than any
+    # 'YYYY-MM' string and so stay hot.
+    t_date = t.get('date', '')
+    return bool(t_date) and t_date[:7] < cutoff
+
+
+def profile_key(profile_name):
+    return 'p_' + quote(profile_name, safe='')
+
+
+def pack(transactions):
+    return zlib.compress(json.dumps(transactions, separators=(',', ':')).encode('utf-8'), 6)
+
+
+def unpack(data):
+    if not data:
+        return []
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+def summarize_month(month, transactions):
+    snapshot = {
+        'month': month,
+        'count': len(transactions),
+        'earned': 0,
+        'spent': 0,
+        'net': 0,
+        'earnings_by_source': defaultdict(int),
+        'spending_by_source': defaultdict(int),
+        'first_date': None,
+        'last_date': None,
+        'first_earning_date': None,
+        'last_spend_date': None,
+        'login_days': set(),
+    }
+    for t in transactions:
+        amount = t.get('amount', 0)
+        t_date = t.get('date', '')
+        snapshot['net'] += amount
+        if snapshot['first_date'] is None or t_date < snapshot['first_date']:
+            snapshot['first_date'] = t_date
+        if snapshot['last_date'] is None or t_date > snapshot['last_date']:
+            snapshot['last_date'] = t_date
+
+        if amount > 0:
+            snapshot['earned'] += amount
+            snapshot['earnings_by_source'][t.get('source', '')] += amount
+            if snapshot['first_earning_date'] is None or t_date < snapshot['first_earning_date']:
+                snapshot['first_earning_date'] = t_date
+            if t.get('source', '').lower() == 'login':
+                snapshot['login_days'].add(t_date[:10])
+        elif amount < 0:
+            snapshot['spent'] += abs(amount)
+            snapshot['spending_by_source'][t.get('source', '')] += abs(amount)
+            if snapshot['last_spend_date'] is None or t_date > snapshot['last_spend_date']:
+                snapshot['last_spend_date'] = t_date
+
+    snapshot['earnings_by_source'] = dict(snapshot['earnings_by_source'])
+    snapshot['spending_by_source'] = dict(snapshot['spending_by_source'])
+    snapshot['login_days'] = sorted(snapshot['login_days'])
+    return snapshot
+
+
+def with_closing_balances(snapshots):
+    ordered = sorted(snapshots, key=lambda s: s['month'])
+    balance = 0
+    for snapshot in ordered:
+        balance += snapshot['net']
+        snapshot['closing_balance'] = balance
+    return ordered
+
+
+def archived_balance(snapshots):
+    return snapshots[-1]['closing_balance'] if snapshots else 0
+
+
+def merge_month(existing, incoming):
+    """Combine an archived month with newly archived rows. Rows are matched by
+    id and the incoming copy wins, so re-archiving is idempotent."""
+    merged = {t['id']: t for t in existing if t.get('id')}
+    merged.update({t['id']: t for t in incoming if t.get('id')})
+    return sorted(merged.values(), key=lambda t: t.get('date', ''))
+
+
+def totals(snapshots):
+    """Everything the dashboard needs from the archived part of a profile."""
+    result = {
+        'balance': archived_balance(snapshots),
+        'earned': 0,
+        'spent': 0,
+        'count': 0,
+        'earnings_by_source': defaultdict(int),
+        'spending_by_source': defaultdict(int),
+        'first_date': None,
+        'first_earning_date': None,
+        'last_spend_date': None,
+        'login_days': set(),
+    }
+    for snapshot in snapshots:
+        result['earned'] += snapshot.get('earned', 0)
+        result['spent'] += snapshot.get('spent', 0)
+        result['count'] += snapshot.get('count', 0)
+        for source, amount in snapshot.get('earnings_by_source', {}).items():
+            result['earnings_by_source'][source] += amount
+        for source, amount in snapshot.get('spending_by_source', {}).items():
+            result['spending_by_source'][source] += amount
+        for field, pick in (('first_date', min), ('first_earning_date', min), ('last_spend_date', max)):
+            if snapshot.get(field):
+                result[field] = snapshot[field] if result[field] is None else pick(result[field], snapshot[field])
+        result['login_days'].update(snapshot.get('login_days', []))
+    return result
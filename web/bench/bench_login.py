@@ -0,0 +1,126 @@
+"""Login hashing benchmark.
+
+Measures password-verify throughput per core through the hashing pool and
+how a concurrent login burst affects the latency of a dashboard-style
+request running in the same worker. Run from the web/ directory:
+
+    python bench/bench_login.py --workers 0 1 2 --logins 8 --seconds 5
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hashing
+
+
+def make_transactions(count):
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    sources = ['Login', 'Ads', 'Daily Games', 'Event Reward', 'Box Draw (Single)']
+    return [{
+        'date': (start + timedelta(minutes=i * 30)).isoformat(),
+        'amount': random.choice([50, 10, 100, -100, -900]),
+        'source': random.choice(sources),
+    } for i in range(count)]
+
+
+def dashboard_request(transactions):
+    # Same shape of work as get_all_data: a few passes over the history.
+    balance = sum(t['amount'] for t in transactions)
+    breakdown = defaultdict(int)
+    for t in transactions:
+        datetime.fromisoformat(t['date'])
+        breakdown[t['source']] += t['amount']
+    sorted(transactions, key=lambda x: x['date'])
+    return balance, breakdown
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(workers, logins, seconds, history):
+    hashing.shutdown()
+    hashing.HASH_WORKERS = workers
+    hashing._pending = threading.BoundedSemaphore(max(hashing.HASH_MAX_PENDING, logins))
+
+    stored = hashing.hash_password('correct horse battery staple')
+    transactions = make_transactions(history)
+    deadline = time.perf_counter() + seconds
+    counts = {'ok': 0, 'busy': 0}
+    counts_lock = threading.Lock()
+    latencies = []
+
+    def login_loop():
+        while time.perf_counter() < deadline:
+            try:
+                hashing.verify_password(stored, 'correct horse battery staple')
+                key = 'ok'
+            except hashing.HashingBusy:
+                key = 'busy'
+            with counts_lock:
+                counts[key] += 1
+
+    def dashboard_loop():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            dashboard_request(transactions)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=login_loop) for _ in range(logins)]
+    threads.append(threading.Thread(target=dashboard_loop))
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    hashing.shutdown()
+
+    cores = max(workers, 1)
+    return {
+        'workers': workers,
+        'logins_per_sec': counts['ok'] / elapsed,
+        'logins_per_sec_per_core': counts['ok'] / elapsed / cores,
+        'rejected': counts['busy'],
+        'dashboard_p50_ms': percentile(latencies, 50),
+        'dashboard_p99_ms': percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2],
+                        help='pool sizes to compare (0 = hash inline)')
+    parser.add_argument('--logins', type=int, default=8, help='concurrent login threads')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--history', type=int, default=2000, help='transactions in the dashboard request')
+    args = parser.parse_args()
+
+    baseline = []
+    transactions = make_transactions(args.history)
+    for _ in range(20):
+        started = time.perf_counter()
+        dashboard_request(transactions)
+        baseline.append((time.perf_counter() - started) * 1000)
+    print(f"method={hashing.HASH_METHOD} cpus={os.cpu_count()}")
+    print(f"dashboard alone: p50={percentile(baseline, 50):.1f}ms p99={percentile(baseline, 99):.1f}ms")
+
+    for workers in args.workers:
+        r = run(workers, args.logins, args.seconds, args.history)
+        print(f"workers={r['workers']:<2} logins/s={r['logins_per_sec']:7.1f} "
+              f"per-core={r['logins_per_sec_per_core']:7.1f} rejected={r['rejected']:<5} "
+              f"dashboard p50={r['dashboard_p50_ms']:.1f}ms p99={r['dashboard_p99_ms']:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
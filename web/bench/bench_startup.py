@@ -0,0 +1,77 @@
+"""Startup benchmark.
+
+Measures, in fresh interpreters, how long a worker takes to import the app,
+serve its first page, and serve its first request that needs storage. The
+default memory backend never touches Firebase; pass --backend firestore to
+include the Firestore imports and client creation. Run from the web/
+directory:
+
+    python bench/bench_startup.py --runs 5 --backend memory firestore
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+WEB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter per sample so nothing is already imported.
+PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+import app as appmod
+imported = time.perf_counter()
+client = appmod.app.test_client()
+client.get('/login')
+first_page = time.perf_counter()
+with client.session_transaction() as s:
+    s['user_id'] = 'bench_user'
+    s['current_profile'] = 'Default'
+client.get('/api/data', headers={'X-Requested-With': 'XMLHttpRequest'})
+first_data = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_page_ms': (first_page - imported) * 1000,
+    'first_data_ms': (first_data - first_page) * 1000,
+    'total_ms': (first_data - started) * 1000,
+    'storage_modules': sorted(m for m in ('firebase_admin', 'grpc', 'google.cloud.firestore') if m in sys.modules),
+}))
+"""
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else 0.0
+
+
+def sample(backend, preload):
+    env = dict(os.environ, STORAGE_BACKEND=backend, JOBS_THREADS='0',
+               STORAGE_PRELOAD='1' if preload else '0', PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run([sys.executable, '-c', PROBE], cwd=WEB_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--backend', nargs='+', default=['memory'], choices=['memory', 'firestore'])
+    parser.add_argument('--preload', action='store_true',
+                        help='also measure with STORAGE_PRELOAD=1 (work a --preload master does once)')
+    args = parser.parse_args()
+
+    print(f"python={sys.version.split()[0]} runs={args.runs}")
+    for backend in args.backend:
+        for preload in ([False, True] if args.preload else [False]):
+            samples = [sample(backend, preload) for _ in range(args.runs)]
+            print(f"backend={backend:<9} preload={'yes' if preload else 'no ':<3} "
+                  f"import={median([s['import_ms'] for s in samples]):7.1f}ms "
+                  f"first page={median([s['first_page_ms'] for s in samples]):7.1f}ms "
+                  f"first data={median([s['first_data_ms'] for s in samples]):7.1f}ms "
+                  f"total={median([s['total_ms'] for s in samples]):7.1f}ms "
+                  f"loaded={','.join(samples[-1]['storage_modules']) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
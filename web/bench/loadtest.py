@@ -0,0 +1,599 @@
+"""Serving-mode load test.
+
+Starts the app under gunicorn on the in-memory storage stand-in, shared by
+every worker through a store server (memstore.py --port) with a simulated
+per-operation round trip. Seeds populations of users with different history
+sizes straight into the store, then drives the real routes over HTTP with a
+weighted traffic mix at ramping concurrency. Reports throughput, per-route
+latency percentiles, error rates and storage operations per request (read
+from the X-Storage-Ops header the memory backend adds). Run from the web/
+directory:
+
+    python bench/loadtest.py --ramp 10 50 100 --stage-seconds 15 --json before.json
+    # ... make the change ...
+    python bench/loadtest.py --ramp 10 50 100 --stage-seconds 15 --compare before.json
+
+Users are given as name=count:history, e.g. --users small=30:20,large=5:5000.
+Seeded history stays inside the archive horizon, so compaction doesn't run
+during a test. Several --worker-class values compare worker classes at the
+same number of worker processes, i.e. the same memory. The same --seed gives
+every run the same users and request sequence per client.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+WEB_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = 'data=40,history=15,add=10,quick_tap=20,quick_edit=5,login=5,admin_stats=5'
+DEFAULT_USERS = 'small=30:20,medium=15:500,large=5:5000'
+
+PASSWORD = 'load-test'
+ADMIN_USERNAME = 'load_admin'
+# Sign-in cost isn't what this test measures; seeding and server agree on it
+# so logins never trigger a rehash.
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+# Within the default ARCHIVE_HORIZON_DAYS (180).
+HISTORY_DAYS = 150
+# What the default quick actions post when tapped.
+QUICK_TAPS = [('Event Reward', 50), ('Ads', 10), ('Daily Games', 100), ('Login', 50),
+              ('Campaign Reward', 50), ('Box Draw (Single)', -100), ('Box Draw (10)', -900)]
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def worker_rss_mb(master_pid):
+    """Resident memory of the master's worker processes."""
+    total_kb = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            if ppid != master_pid:
+                continue
+            with open(f'/proc/{entry}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+    return total_kb / 1024
+
+
+class Process:
+    """A child process started from web/ whose output is kept for errors."""
+
+    def __init__(self, argv, env):
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(argv, cwd=WEB_DIR, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, probe, what, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'{what} exited early:\n{self.output()}')
+            try:
+                probe()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise RuntimeError(f'{what} did not start:\n{self.output()}')
+
+    def output(self):
+        self.log.seek(0)
+        return self.log.read().decode('utf-8', 'replace')[-4000:]
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+class StoreServer(Process):
+    def __init__(self):
+        self.address = ('127.0.0.1', free_port())
+        super().__init__([sys.executable, 'memstore.py', '--port', str(self.address[1])], dict(os.environ))
+        self.wait_ready(lambda: socket.create_connection(self.address, timeout=2).close(), 'store server')
+
+
+class Server(Process):
+    def __init__(self, worker_class, workers, latency_ms, store_address, extra_env=None):
+        self.port = free_port()
+        self.jobs_dir = tempfile.TemporaryDirectory()
+        env = dict(os.environ,
+                   STORAGE_BACKEND='memory',
+                   MEMSTORE_ADDRESS=f'{store_address[0]}:{store_address[1]}',
+                   MEMSTORE_LATENCY_MS=str(latency_ms),
+                   GUNICORN_WORKER_CLASS=worker_class,
+                   WEB_CONCURRENCY=str(workers),
+                   GUNICORN_MAX_REQUESTS='0',
+                   JOBS_DB_PATH=os.path.join(self.jobs_dir.name, 'jobs.sqlite3'),
+                   JOBS_THREADS=os.environ.get('JOBS_THREADS', '2'),
+                   PASSWORD_HASH_METHOD=PASSWORD_HASH_METHOD,
+                   PASSWORD_HASH_WORKERS='0')
+        env.update(extra_env or {})
+        super().__init__([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                          '-b', f'127.0.0.1:{self.port}', 'app:app'], env)
+        self.wait_ready(self.probe, 'server')
+
+    def probe(self):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=2)
+        conn.request('GET', '/login')
+        conn.getresponse().read()
+
+    def stop(self):
+        super().stop()
+        self.jobs_dir.cleanup()
+
+
+class Client:
+    """One keep-alive connection with its own session cookie."""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = None
+        self.cookie = None
+
+    def request(self, method, path, body=None):
+        headers = {'X-Requested-With': 'XMLHttpRequest'}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            try:
+                self.conn.request(method, path, body=payload, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # The server may close idle keep-alive connections.
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+        for name, value in response.getheaders():
+            if name.lower() == 'set-cookie' and value.startswith('session='):
+                self.cookie = value.split(';', 1)[0]
+        return response.status, data, response.getheader('X-Storage-Ops')
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+# --- Users ---
+
+class VirtualUser:
+    def __init__(self, username, population, history):
+        self.username = username
+        self.population = population
+        self.history = history
+        self.cookie = None
+
+
+def parse_users(text):
+    """'small=30:20,large=5:5000' -> [('small', 30, 20), ('large', 5, 5000)]"""
+    populations = []
+    for part in text.split(','):
+        name, _, spec = part.partition('=')
+        count, _, history = spec.partition(':')
+        try:
+            populations.append((name, int(count), int(history or 0)))
+        except ValueError:
+            raise SystemExit(f'bad user population {part!r}; expected name=count:history')
+    return populations
+
+
+def history_rows(count, rng, now):
+    rows = []
+    for _ in range(count):
+        source, amount = rng.choice(QUICK_TAPS[:5] * 3 + QUICK_TAPS[5:])
+        when = now - timedelta(seconds=rng.uniform(0, HISTORY_DAYS * 86400))
+        rows.append({'id': str(uuid.uuid4()), 'date': when.isoformat(), 'amount': amount, 'source': source})
+    return rows
+
+
+def import_app():
+    """The app module, on the memory backend, for writing seed data with the
+    app's own code so documents have exactly the shape the routes expect."""
+    if WEB_DIR not in sys.path:
+        sys.path.insert(0, WEB_DIR)
+    # The modules read these at import time. Put the old values back after,
+    # so the servers started later don't inherit them (JOBS_THREADS=0 would
+    # leave them without job threads).
+    overrides = dict(STORAGE_BACKEND='memory', JOBS_THREADS='0',
+                     JOBS_DB_PATH=os.path.join(tempfile.gettempdir(), f'loadtest-jobs-{os.getpid()}.sqlite3'),
+                     PASSWORD_HASH_METHOD=PASSWORD_HASH_METHOD, PASSWORD_HASH_WORKERS='0')
+    saved = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    try:
+        import app
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return app
+
+
+def seed(store_address, populations, seed_value):
+    appmod = import_app()
+    import memstore
+    import storage
+    storage.use(memstore.RemoteStore(store_address))
+
+    rng = random.Random(seed_value)
+    now = datetime.now(timezone.utc)
+    users = []
+
+    def create(username, role, history):
+        user_id = str(uuid.uuid4())
+        appmod.db.collection('users').document(user_id).set({
+            'username': username,
+            'username_lower': username.lower(),
+            'password_hash': appmod.hash_password(PASSWORD),
+            'created_at': appmod.dt_now_iso(),
+            'role': role
+        })
+        if history:
+            tracker = appmod.WebCoinTracker('Default', user_id)
+            if not tracker.save_data(history_rows(history, rng, now), settings=tracker.get_default_settings()):
+                raise RuntimeError(f'could not seed {username}')
+
+    for population, count, history in populations:
+        for i in range(count):
+            user = VirtualUser(f'load_{population}_{i}', population, history)
+            create(user.username, 'user', history)
+            users.append(user)
+    admin = VirtualUser(ADMIN_USERNAME, 'admin', 0)
+    create(admin.username, 'admin', 0)
+    appmod.build_admin_rollup()
+    # Spread each population across the clients instead of in blocks.
+    rng.shuffle(users)
+    return users, admin
+
+
+def sign_in(port, user):
+    client = Client(port)
+    status, _, _ = client.request('POST', '/api/login', {'username': user.username, 'password': PASSWORD})
+    if status != 200:
+        raise RuntimeError(f'login failed for {user.username}: {status}')
+    client.close()
+    user.cookie = client.cookie
+
+
+# --- Traffic ---
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = defaultdict(new_stats)
+        self.populations = defaultdict(new_stats)
+
+
+def new_stats():
+    return {'latencies': [], 'errors': 0, 'reads': 0, 'writes': 0, 'counted': 0}
+
+
+def add_sample(stats, elapsed_ms, ok, ops):
+    stats['latencies'].append(elapsed_ms)
+    if not ok:
+        stats['errors'] += 1
+    if ops:
+        stats['counted'] += 1
+        stats['reads'] += ops.get('reads', 0)
+        stats['writes'] += ops.get('writes', 0)
+
+
+def parse_ops(header):
+    if not header:
+        return None
+    ops = {}
+    for part in header.split():
+        name, _, value = part.partition('=')
+        ops[name] = int(value)
+    return ops
+
+
+class Session:
+    """One simulated client: a user's session plus an admin session for the
+    admin routes."""
+
+    def __init__(self, port, user, admin, recorder, rng):
+        self.user = user
+        self.rng = rng
+        self.recorder = recorder
+        self.client = Client(port)
+        self.client.cookie = user.cookie
+        self.admin_client = Client(port)
+        self.admin_client.cookie = admin.cookie
+
+    def call(self, method, path, body=None, admin=False):
+        client = self.admin_client if admin else self.client
+        started = time.perf_counter()
+        try:
+            status, data, ops = client.request(method, path, body)
+        except (http.client.HTTPException, OSError):
+            status, data, ops = 0, b'', None
+        elapsed = (time.perf_counter() - started) * 1000
+        ok = 200 <= status < 300
+        ops = parse_ops(ops)
+        route = f"{method} {path.split('?', 1)[0]}"
+        with self.recorder.lock:
+            add_sample(self.recorder.routes[route], elapsed, ok, ops)
+            add_sample(self.recorder.populations['admin' if admin else self.user.population], elapsed, ok, ops)
+        try:
+            return status, json.loads(data) if ok else None
+        except ValueError:
+            return status, None
+
+    def close(self):
+        self.client.close()
+        self.admin_client.close()
+
+
+def do_login(s):
+    s.client.cookie = None
+    s.call('POST', '/api/login', {'username': s.user.username, 'password': PASSWORD})
+
+
+def do_data(s):
+    s.call('GET', '/api/data')
+
+
+def do_history(s):
+    pages = max(1, min(5, -(-s.user.history // 20)))
+    s.call('GET', f'/api/history?page={s.rng.randint(1, pages)}')
+
+
+def do_add(s):
+    s.call('POST', '/api/add-transaction',
+           {'amount': s.rng.choice([10, 50, 100, -100]), 'source': 'Load Test', 'date': None})
+
+
+def do_quick_tap(s):
+    source, amount = s.rng.choice(QUICK_TAPS)
+    s.call('POST', '/api/add-transaction', {'amount': amount, 'source': source, 'date': None})
+
+
+def do_quick_edit(s):
+    status, body = s.call('POST', '/api/add-quick-action', {'text': 'Load Test', 'value': 25, 'is_positive': True})
+    if not body:
+        return
+    added = [i for i, a in enumerate(body['settings']['quick_actions']) if a.get('text') == 'Load Test']
+    if added:
+        s.call('POST', '/api/delete-quick-action', {'index': added[-1]})
+
+
+def do_admin_stats(s):
+    s.call('GET', '/api/admin/stats', admin=True)
+
+
+ACTIONS = {
+    'login': do_login,
+    'data': do_data,
+    'history': do_history,
+    'add': do_add,
+    'quick_tap': do_quick_tap,
+    'quick_edit': do_quick_edit,
+    'admin_stats': do_admin_stats,
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in ACTIONS:
+            raise SystemExit(f'unknown action {name!r}; choose from {", ".join(ACTIONS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def drive(port, users, admin, mix, concurrency, seconds, seed_value):
+    names, weights = list(mix), list(mix.values())
+    recorder = Recorder()
+    deadline = time.perf_counter() + seconds
+
+    def loop(index):
+        rng = random.Random(f'{seed_value}:{index}')
+        session = Session(port, users[index % len(users)], admin, recorder, rng)
+        while time.perf_counter() < deadline:
+            ACTIONS[rng.choices(names, weights)[0]](session)
+        session.close()
+
+    threads = [threading.Thread(target=loop, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder, time.perf_counter() - started
+
+
+# --- Reporting ---
+
+def summarize(stats, elapsed):
+    latencies = stats['latencies']
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'error_rate': stats['errors'] / len(latencies) if latencies else 0.0,
+        'reads_per_request': stats['reads'] / stats['counted'] if stats['counted'] else None,
+        'writes_per_request': stats['writes'] / stats['counted'] if stats['counted'] else None,
+    }
+
+
+def stage_result(concurrency, recorder, elapsed):
+    total = new_stats()
+    for stats in recorder.routes.values():
+        for key in ('errors', 'reads', 'writes', 'counted'):
+            total[key] += stats[key]
+        total['latencies'].extend(stats['latencies'])
+    return {
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'total': summarize(total, elapsed),
+        'routes': {route: summarize(stats, elapsed) for route, stats in sorted(recorder.routes.items())},
+        'populations': {name: summarize(stats, elapsed) for name, stats in sorted(recorder.populations.items())},
+    }
+
+
+def format_ops(value):
+    return '      -' if value is None else f'{value:7.1f}'
+
+
+def print_table(title, rows):
+    print(f"  {title:<34} {'req':>6} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err%':>6} "
+          f"{'reads':>7} {'writes':>7}")
+    for name, r in rows.items():
+        print(f"  {name:<34} {r['requests']:>6} {r['rps']:8.1f} {r['p50_ms']:6.1f}ms {r['p95_ms']:6.1f}ms "
+              f"{r['p99_ms']:6.1f}ms {r['error_rate'] * 100:5.1f}% {format_ops(r['reads_per_request'])} "
+              f"{format_ops(r['writes_per_request'])}")
+
+
+def print_stage(stage):
+    t = stage['total']
+    print(f"concurrency={stage['concurrency']:<4} req/s={t['rps']:8.1f} p50={t['p50_ms']:6.1f}ms "
+          f"p95={t['p95_ms']:6.1f}ms p99={t['p99_ms']:6.1f}ms errors={t['error_rate'] * 100:.1f}% "
+          f"requests={t['requests']}")
+    print_table('route', stage['routes'])
+    print_table('population', stage['populations'])
+
+
+def change(new, old):
+    if not old:
+        return '     n/a'
+    return f'{(new - old) / old * 100:+7.1f}%'
+
+
+def print_comparison(result, baseline):
+    """Per-stage and per-route changes against a previous --json result, for
+    runs with the same worker class and concurrency."""
+    before = {(run['worker_class'], stage['concurrency']): stage
+              for run in baseline['runs'] for stage in run['stages']}
+    print(f"\nCompared with {baseline.get('label') or 'baseline'} (positive req/s and negative latency are better)")
+    for run in result['runs']:
+        for stage in run['stages']:
+            old = before.get((run['worker_class'], stage['concurrency']))
+            if old is None:
+                continue
+            print(f"{run['worker_class']} concurrency={stage['concurrency']}: "
+                  f"req/s {change(stage['total']['rps'], old['total']['rps'])} "
+                  f"p50 {change(stage['total']['p50_ms'], old['total']['p50_ms'])} "
+                  f"p99 {change(stage['total']['p99_ms'], old['total']['p99_ms'])} "
+                  f"errors {old['total']['error_rate'] * 100:.1f}% -> {stage['total']['error_rate'] * 100:.1f}%")
+            for route, r in stage['routes'].items():
+                o = old['routes'].get(route)
+                if o is None:
+                    continue
+                reads = ''
+                if r['reads_per_request'] is not None and o['reads_per_request'] is not None:
+                    reads = (f" reads/req {o['reads_per_request']:.1f} -> {r['reads_per_request']:.1f}"
+                             f" writes/req {o['writes_per_request']:.1f} -> {r['writes_per_request']:.1f}")
+                print(f"  {route:<34} p50 {change(r['p50_ms'], o['p50_ms'])} "
+                      f"p95 {change(r['p95_ms'], o['p95_ms'])} p99 {change(r['p99_ms'], o['p99_ms'])}{reads}")
+
+
+# --- Runs ---
+
+def run(worker_class, args, populations, mix):
+    store = StoreServer()
+    try:
+        users, admin = seed(store.address, populations, args.seed)
+        server = Server(worker_class, args.workers, args.latency_ms, store.address)
+        try:
+            for user in users + [admin]:
+                sign_in(server.port, user)
+            if args.warmup:
+                drive(server.port, users, admin, mix, args.ramp[0], args.warmup, args.seed)
+            stages = []
+            for concurrency in args.ramp:
+                recorder, elapsed = drive(server.port, users, admin, mix, concurrency, args.stage_seconds, args.seed)
+                stages.append(stage_result(concurrency, recorder, elapsed))
+                print(f"\n[{worker_class}] ", end='')
+                print_stage(stages[-1])
+            rss = worker_rss_mb(server.process.pid)
+        finally:
+            server.stop()
+    finally:
+        store.stop()
+    print(f"[{worker_class}] worker rss={rss:.0f}MB")
+    return {'worker_class': worker_class, 'rss_mb': rss, 'stages': stages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--worker-class', nargs='+', default=['gevent'], choices=['sync', 'gthread', 'gevent'])
+    parser.add_argument('--workers', type=int, default=1, help='worker processes per server')
+    parser.add_argument('--ramp', type=int, nargs='+', default=[10, 50], help='concurrent clients per stage')
+    parser.add_argument('--stage-seconds', type=float, default=15)
+    parser.add_argument('--warmup', type=float, default=3, help='unrecorded seconds before the first stage')
+    parser.add_argument('--users', default=DEFAULT_USERS,
+                        help=f'populations as name=count:history (default {DEFAULT_USERS})')
+    parser.add_argument('--latency-ms', type=float, default=15, help='simulated storage round trip')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'action weights (default {DEFAULT_MIX})')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--label', help='name stored with --json output')
+    parser.add_argument('--json', metavar='PATH', help='write results here')
+    parser.add_argument('--compare', metavar='PATH', help='print changes against an earlier --json result')
+    args = parser.parse_args()
+
+    populations = parse_users(args.users)
+    mix = parse_mix(args.mix)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    config = {key: getattr(args, key) for key in
+              ('workers', 'ramp', 'stage_seconds', 'users', 'latency_ms', 'mix', 'seed')}
+    print(' '.join(f'{key}={value}' for key, value in config.items()))
+    result = {'label': args.label, 'config': config,
+              'runs': [run(worker_class, args, populations, mix) for worker_class in args.worker_class]}
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    if baseline:
+        print_comparison(result, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+import os
+import math
+from datetime import date, datetime, timedelta, timezone
+from collections import defaultdict
+
+# --- Earning-Rate Forecasts ---
+# Each profile carries a small forecast state next to its transactions:
+# per-day earning totals for recent days (overall and by source), an
+# exponentially weighted daily earning rate over every completed day, and
+# lifetime totals. Writes patch the state with the rows they add or remove;
+# reads fold in the days that completed since the last write without changing
+# the stored state. Projecting a goal costs the same for a week of history as
+# for five years.
+#
+# Stored under profiles.{name}.forecast:
+#   v             state format (a mismatch means rebuild)
+#   days          {'YYYY-MM-DD': {'total': n, 'sources': {source: n}}}; the
+#                 last FORECAST_KEEP_DAYS days plus anything not yet folded
+#   first_day     first day with an earning
+#   folded_day    last day included in the EWMA (always a completed day)
+#   ewma, weight  EWMA of daily earnings and its bias correction, 1 - (1-a)^n
+#   ewma_sources  per-source EWMA, same weight
+#   lifetime      total earned
+#
+# Days are UTC calendar days taken from the transaction's ISO date. Today is
+# never folded: a half-finished day would drag every rate down.
+
+STATE_VERSION = 1
+FORECAST_HALF_LIFE_DAYS = float(os.environ.get('FORECAST_HALF_LIFE_DAYS', 7))
+# Covers the longest fixed window (30 days) plus today.
+FORECAST_KEEP_DAYS = 31
+WINDOWS = (7, 30)
+# Below this many completed days the EWMA is mostly noise; the lifetime
+# average is used for the headline estimate instead.
+MIN_EWMA_DAYS = 7
+# Projections further out than this are reported as unreachable.
+MAX_PROJECTION_DAYS = 3650
+
+ALPHA = 1 - 0.5 ** (1 / FORECAST_HALF_LIFE_DAYS)
+
+
+class RebuildNeeded(Exception):
+    """A change can't be applied incrementally (e.g. it moves the first
+    earning day); rebuild the state from the transactions."""
+
+
+def _today():
+    return datetime.now(timezone.utc).date()
+
+
+def earning_day(t):
+    """Day string of an earning, or None for spends and unreadable dates."""
+    if t.get('amount', 0) <= 0:
+        return None
+    t_date = t.get('date') or ''
+    try:
+        return date.fromisoformat(t_date[:10]).isoformat()
+    except ValueError:
+        return None
+
+
+def _days_between(a, b):
+    return (date.fromisoformat(b) - date.fromisoformat(a)).days
+
+
+def _shift(day, days):
+    return (date.fromisoformat(day) + timedelta(days=days)).isoformat()
+
+
+def empty_state():
+    return {
+        'v': STATE_VERSION,
+        'days': {},
+        'first_day': None,
+        'folded_day': None,
+        'ewma': 0.0,
+        'weight': 0.0,
+        'ewma_sources': {},
+        'lifetime': 0,
+    }
+
+
+def is_current(state):
+    return bool(state) and state.get('v') == STATE_VERSION
+
+
+def daily_totals(transactions):
+    """{'YYYY-MM-DD': {'total': n, 'sources': {source: n}}} over earnings."""
+    days = {}
+    for t in transactions:
+        day = earning_day(t)
+        if day is None:
+            continue
+        entry = days.setdefault(day, {'total': 0, 'sources': {}})
+        entry['total'] += t['amount']
+        source = t.get('source', '')
+        entry['sources'][source] = entry['sources'].get(source, 0) + t['amount']
+    return days
+
+
+# --- Folding ---
+
+def _fold(state, days, through):
+    """EWMA values after folding every day up to `through` (inclusive) into
+    the state. Gaps between earning days decay in one step, so the cost
+    depends on the number of days with earnings, not the calendar span."""
+    ewma, weight = state['ewma'], state['weight']
+    sources = dict(state['ewma_sources'])
+    start = state['folded_day']
+    if start is None:
+        if state['first_day'] is None or state['first_day'] > through:
+            return ewma, weight, sources, None
+        # Nothing folded yet: start the day before the first earning.
+        start = _shift(state['first_day'], -1)
+    if start >= through:
+        return ewma, weight, sources, start
+
+    keep = 1 - ALPHA
+    last = start
+    for day in sorted(d for d in days if start < d <= through):
+        decay = keep ** _days_between(last, day)
+        entry = days[day]
+        ewma = ewma * decay + ALPHA * entry['total']
+        weight = weight * decay + (1 - decay)
+        for source in sources:
+            sources[source] *= decay
+        for source, amount in entry['sources'].items():
+            sources[source] = sources.get(source, 0.0) + ALPHA * amount
+        last = day
+    decay = keep ** _days_between(last, through)
+    ewma *= decay
+    weight = 1 - (1 - weight) * decay
+    for source in sources:
+        sources[source] *= decay
+    return ewma, weight, sources, through
+
+
+def advance(state, today=None):
+    """Fold completed days into the stored state and drop days that no window
+    needs any more."""
+    today = today or _today()
+    yesterday = (today - timedelta(days=1)).isoformat()
+    ewma, weight, sources, folded_day = _fold(state, state['days'], yesterday)
+    state['ewma'], state['weight'], state['folded_day'] = ewma, weight, folded_day
+    state['ewma_sources'] = {s: v for s, v in sources.items() if v > 1e-9}
+
+    oldest = (today - timedelta(days=FORECAST_KEEP_DAYS)).isoformat()
+    state['days'] = {d: v for d, v in state['days'].items()
+                     if d >= oldest or folded_day is None or d > folded_day}
+    return state
+
+
+# --- Building and Patching ---
+
+def build(transactions, archived=None, today=None):
+    """State from scratch. `archived` is archive.totals() of the profile's
+    snapshots; archived days only contribute to lifetime totals and the first
+    earning day, so the EWMA starts at the archive horizon (at a 7-day
+    half-life, older days would carry well under 1% of the weight)."""
+    today = today or _today()
+    state = empty_state()
+    all_days = daily_totals(transactions)
+    state['days'] = all_days
+    state['lifetime'] = sum(entry['total'] for entry in all_days.values())
+    if all_days:
+        state['first_day'] = min(all_days)
+
+    if archived and archived.get('earned'):
+        state['lifetime'] += archived['earned']
+        first = (archived.get('first_earning_date') or '')[:10]
+        if first and (state['first_day'] is None or first < state['first_day']):
+            # Folding starts here; the archived days in between count as
+            # zero-earning days, which understates the rate only slightly.
+            state['first_day'] = first
+    return advance(state, today)
+
+
+def apply(state, added=(), removed=(), today=None):
+    """Patch the state with saved changes. `added` and `removed` are
+    transaction dicts (an update is a remove of the old row plus an add).
+    Raises RebuildNeeded when the change can't be applied in place."""
+    today = today or _today()
+    if not is_current(state):
+        raise RebuildNeeded()
+    advance(state, today)
+    today_str = today.isoformat()
+
+    changes = [(t, -1) for t in removed] + [(t, 1) for t in added]
+    keep = 1 - ALPHA
+    for t, sign in changes:
+        day = earning_day(t)
+        if day is None:
+            continue
+        if state['first_day'] is None or day < state['first_day']:
+            if day < today_str:
+                raise RebuildNeeded()
+            state['first_day'] = day
+        elif sign < 0 and day == state['first_day']:
+            # The first earning day may be going away.
+            raise RebuildNeeded()
+
+        amount = sign * t['amount']
+        source = t.get('source', '')
+        state['lifetime'] += amount
+
+        folded_day = state['folded_day']
+        if folded_day is not None and day <= folded_day:
+            # ewma = sum(a * (1-a)^(folded_day - d) * x_d), so a change to
+            # x_d shifts it by the same factor.
+            factor = ALPHA * keep ** _days_between(day, folded_day)
+            state['ewma'] += factor * amount
+            state['ewma_sources'][source] = state['ewma_sources'].get(source, 0.0) + factor * amount
+
+        if folded_day is None or day > folded_day or day >= (today - timedelta(days=FORECAST_KEEP_DAYS)).isoformat():
+            entry = state['days'].setdefault(day, {'total': 0, 'sources': {}})
+            entry['total'] += amount
+            entry['sources'][source] = entry['sources'].get(source, 0) + amount
+            if not entry['sources'][source]:
+                del entry['sources'][source]
+            if not entry['total'] and not entry['sources']:
+                del state['days'][day]
+    return state
+
+
+# --- Reading ---
+
+def _window_rates(state, today, completed_days):
+    rates, source_rates = {}, defaultdict(dict)
+    for window in WINDOWS:
+        span = min(window, completed_days)
+        if span <= 0:
+            rates[f'{window}d'] = None
+            continue
+        start = (today - timedelta(days=span)).isoformat()
+        end = today.isoformat()
+        total, by_source = 0, defaultdict(int)
+        for day, entry in state['days'].items():
+            if start <= day < end:
+                total += entry['total']
+                for source, amount in entry['sources'].items():
+                    by_source[source] += amount
+        rates[f'{window}d'] = total / span
+        for source, amount in by_source.items():
+            if amount:
+                source_rates[source][f'{window}d'] = amount / span
+    return rates, source_rates
+
+
+def _project(rate, remaining, today):
+    if remaining <= 0:
+        return {'days': 0, 'date': today.isoformat()}
+    if not rate or rate <= 0:
+        return None
+    days = math.ceil(remaining / rate)
+    if days > MAX_PROJECTION_DAYS:
+        return None
+    return {'days': days, 'date': (today + timedelta(days=days)).isoformat()}
+
+
+def summary(state, balance, goal, today=None):
+    """Earning rates (per day), per-source run rates and goal projections.
+    Doesn't modify the state; the cost is bounded by the retained days."""
+    today = today or _today()
+    yesterday = (today - timedelta(days=1)).isoformat()
+    ewma, weight, ewma_sources, _ = _fold(state, state['days'], yesterday)
+
+    first_day = state['first_day']
+    completed_days = _days_between(first_day, today.isoformat()) if first_day else 0
+
+    rates, source_rates = _window_rates(state, today, completed_days)
+    rates['ewma'] = ewma / weight if weight > 0 else None
+    rates['lifetime'] = state['lifetime'] / max(1, completed_days) if first_day else None
+    for source, value in ewma_sources.items():
+        if weight > 0 and value > 1e-9:
+            source_rates[source]['ewma'] = value / weight
+
+    method = 'ewma' if completed_days >= MIN_EWMA_DAYS else 'lifetime'
+    remaining = goal - balance
+    projections = {name: _project(rate, remaining, today) for name, rate in rates.items()}
+    headline = projections[method]
+    return {
+        'method': method,
+        'estimated_days': headline['days'] if headline else 'N/A',
+        'goal_date': headline['date'] if headline else None,
+        # There are earnings, but not enough lately to reach the goal within
+        # MAX_PROJECTION_DAYS (or at all); 'N/A' alone means no earnings yet.
+        'unreachable': headline is None and bool(rates['lifetime']),
+        'rates': rates,
+        'source_rates': dict(source_rates),
+        'projections': projections,
+    }
+
+
+# --- Backtesting ---
+
+def backtest(days, horizons=(7, 30), min_history=MIN_EWMA_DAYS, today=None):
+    """Replay a profile's history: at every day with at least `min_history`
+    completed days behind it, predict earnings over each horizon with each
+    method and compare with what was actually earned. `days` is
+    daily_totals() over the whole history. Returns per horizon and method the
+    sample count, mean absolute error, mean error (bias; positive means the
+    forecast was high) and the sum of actual earnings, all in coins."""
+    today = today or _today()
+    if not days:
+        return {}
+    first = date.fromisoformat(min(days))
+    last = today - timedelta(days=1)
+    span = (last - first).days + 1
+    if span <= 0:
+        return {}
+
+    totals = [0] * span
+    for day, entry in days.items():
+        index = (date.fromisoformat(day) - first).days
+        if 0 <= index < span:
+            totals[index] += entry['total']
+    prefix = [0]
+    for value in totals:
+        prefix.append(prefix[-1] + value)
+
+    results = {h: defaultdict(lambda: {'samples': 0, 'abs_error': 0.0, 'error': 0.0, 'actual': 0}) for h in horizons}
+    ewma = weight = 0.0
+    keep = 1 - ALPHA
+    for cutoff in range(span):
+        # Rates use days [0, cutoff); the forecast covers [cutoff, cutoff + h).
+        if cutoff >= min_history:
+            rates = {'ewma': ewma / weight if weight > 0 else 0.0,
+                     'lifetime': prefix[cutoff] / cutoff}
+            for window in WINDOWS:
+                width = min(window, cutoff)
+                rates[f'{window}d'] = (prefix[cutoff] - prefix[cutoff - width]) / width
+            for horizon in horizons:
+                if cutoff + horizon > span:
+                    continue
+                actual = prefix[cutoff + horizon] - prefix[cutoff]
+                for name, rate in rates.items():
+                    error = rate * horizon - actual
+                    stats = results[horizon][name]
+                    stats['samples'] += 1
+                    stats['abs_error'] += abs(error)
+                    stats['error'] += error
+                    stats['actual'] += actual
+        ewma = ewma * keep + ALPHA * totals[cutoff]
+        weight = weight * keep + ALPHA
+    return {h: dict(methods) for h, methods in results.items() if methods}
+
+
+def combine_backtests(reports):
+    """Pool backtest() results from many profiles into mean errors."""
+    pooled = defaultdict(lambda: defaultdict(lambda: {'samples': 0, 'abs_error': 0.0, 'error': 0.0, 'actual': 0}))
+    for report in reports:
+        for horizon, methods in report.items():
+            for name, stats in methods.items():
+                target = pooled[horizon][name]
+                for key in target:
+                    target[key] += stats[key]
+
+    summary_by_horizon = {}
+    for horizon, methods in sorted(pooled.items()):
+        summary_by_horizon[f'{horizon}d'] = {
+            name: {
+                'samples': stats['samples'],
+                'mae': round(stats['abs_error'] / stats['samples'], 2),
+                'bias': round(stats['error'] / stats['samples'], 2),
+                # Absolute error relative to what was actually earned.
+                'wape': round(stats['abs_error'] / stats['actual'], 4) if stats['actual'] else None,
+            }
+            for name, stats in sorted(methods.items()) if stats['samples']
+        }
+    return summary_by_horizon
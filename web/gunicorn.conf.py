@@ -0,0 +1,73 @@
+import os
+import sys
+import subprocess
+
+# --- Gunicorn Settings ---
+# Picked up by `gunicorn app:app` when started from web/. Requests spend most
+# of their time waiting on Firestore, so the default worker is gevent: each
+# process serves many requests concurrently on one shared storage client
+# instead of one request at a time.
+#
+#   GUNICORN_WORKER_CLASS        gevent (default), gthread or sync
+#   WEB_CONCURRENCY              worker processes (default 2)
+#   GUNICORN_WORKER_CONNECTIONS  concurrent requests per gevent worker
+#   GUNICORN_THREADS             threads per gthread worker
+#   GUNICORN_PRELOAD             1 = import the app once in the master
+#
+# With gevent workers, background jobs run in a separate, unpatched process
+# (jobrunner.py) started by the master, with JOBS_THREADS threads; the web
+# workers only queue them.
+#
+# Render sets PORT, which gunicorn binds to on 0.0.0.0 by default.
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 200))
+threads = int(os.environ.get('GUNICORN_THREADS', 8 if worker_class == 'gthread' else 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then so a slow leak can't pin memory.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+preload_app = os.environ.get('GUNICORN_PRELOAD', '') == '1'
+if preload_app:
+    # The master loads the storage imports and credentials once; each worker
+    # still opens its own connection after the fork (see storage.py).
+    os.environ.setdefault('STORAGE_PRELOAD', '1')
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+
+job_runner_threads = int(os.environ.get('JOBS_THREADS', 2))
+
+if worker_class == 'gevent':
+    # Set before the app is imported, in the master (preload) or a worker.
+    os.environ['JOBS_THREADS'] = '0'
+    # Patch before the app (or anything it imports) creates locks or
+    # sockets, and let gRPC cooperate with the gevent hub.
+    from gevent import monkey
+    monkey.patch_all()
+    try:
+        import grpc.experimental.gevent
+        grpc.experimental.gevent.init_gevent()
+    except ImportError:
+        pass
+
+
+def post_worker_init(worker):
+    # Connect before taking traffic so the first request doesn't pay for it.
+    import storage
+    storage.get_client()
+
+
+def when_ready(server):
+    if worker_class != 'gevent' or job_runner_threads <= 0:
+        return
+    env = dict(os.environ, JOBS_THREADS=str(job_runner_threads))
+    server.job_runner = subprocess.Popen([sys.executable, 'jobrunner.py'], env=env,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def on_exit(server):
+    runner = getattr(server, 'job_runner', None)
+    if runner is not None and runner.poll() is None:
+        runner.terminate()
@@ -0,0 +1,126 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+# --- Password Hashing Pool ---
+# Password hashing is deliberately slow, so it runs in a small per-worker
+# process pool instead of on the request thread. The number of logins that
+# may wait on the pool is capped; anything beyond that is rejected right away
+# with HashingBusy so a login burst can't pile up behind the pool.
+
+# Werkzeug method string, e.g. "pbkdf2:sha256:600000" or "scrypt:32768:8:1".
+# Stored hashes that were made with a different method are upgraded on login.
+HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+HASH_SALT_LENGTH = int(os.environ.get('PASSWORD_HASH_SALT_LENGTH', 16))
+
+# 0 workers hashes inline on the request thread (useful for local dev).
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 1))
+HASH_MAX_PENDING = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 8))
+HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+# "spawn" keeps the hashing processes clear of any gRPC/Firestore state
+# already set up in the worker that owns them.
+HASH_START_METHOD = os.environ.get('PASSWORD_HASH_START_METHOD', 'spawn')
+
+
+class HashingBusy(Exception):
+    pass
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+_pending = threading.BoundedSemaphore(HASH_MAX_PENDING)
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    # The pool is created lazily and per process, so a forked gunicorn
+    # worker never inherits its parent's pool.
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(
+                max_workers=HASH_WORKERS,
+                mp_context=multiprocessing.get_context(HASH_START_METHOD)
+            )
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def _reset_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _run(fn, *args):
+    if HASH_WORKERS <= 0:
+        return fn(*args)
+
+    if not _pending.acquire(blocking=False):
+        raise HashingBusy("Too many pending password hashes")
+    try:
+        future = _get_executor().submit(fn, *args)
+    except BrokenProcessPool:
+        _pending.release()
+        _reset_executor()
+        raise HashingBusy("Password hashing pool restarted")
+    except BaseException:
+        _pending.release()
+        raise
+    # The slot is held until the hash actually finishes, not until this
+    # caller stops waiting: a timed-out hash that already started keeps its
+    # pool worker busy and must keep counting against the cap.
+    future.add_done_callback(lambda _: _pending.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        raise HashingBusy("Password hashing timed out")
+    except BrokenProcessPool:
+        _reset_executor()
+        raise HashingBusy("Password hashing pool restarted")
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, HASH_METHOD, HASH_SALT_LENGTH)
+
+
+def verify_password(password_hash, password):
+    if not password_hash or password is None:
+        return False
+    return _run(check_password_hash, password_hash, password)
+
+
+def _resolve_method(method):
+    """A method string with werkzeug's defaults filled in, the form it
+    stores in the hash: "pbkdf2" -> "pbkdf2:sha256:600000"."""
+    name, *args = method.split(':')
+    try:
+        if name == 'pbkdf2' and len(args) <= 2:
+            digest = args[0] if args else 'sha256'
+            iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+            return f"pbkdf2:{digest}:{iterations}"
+        if name == 'scrypt' and len(args) in (0, 3):
+            n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+            return f"scrypt:{n}:{r}:{p}"
+    except ValueError:
+        pass
+    return method
+
+
+_RESOLVED_HASH_METHOD = _resolve_method(HASH_METHOD)
+
+
+def needs_rehash(password_hash):
+    if not password_hash or '$' not in password_hash:
+        return True
+    return _resolve_method(password_hash.split('$', 1)[0]) != _RESOLVED_HASH_METHOD
+
+
+def shutdown():
+    _reset_executor()
@@ -0,0 +1,30 @@
+import os
+import sys
+import time
+import signal
+
+# --- Job Runner Process ---
+# Runs the background job threads (see jobs.py) outside the web workers. The
+# gunicorn config starts it when workers are gevent: monkey-patched job
+# threads would be greenlets on the request hub, and a CPU-heavy job or a
+# blocking SQLite wait would stall every request in that worker. This process
+# is not patched, so jobs get real OS threads. It exits with the gunicorn
+# master.
+
+import app  # noqa: F401  (registers the job handlers)
+import jobs
+
+
+def main():
+    master = os.getppid()
+    # Exit cleanly when the master stops us. A job cut off mid-run is picked
+    # up again once its lease runs out.
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    jobs.start()
+    print(f"Job runner started (pid {os.getpid()}, {jobs.JOBS_THREADS} threads)")
+    while os.getppid() == master:
+        time.sleep(5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+import traceback
+from datetime import datetime, timezone
+
+# --- Background Job Runner ---
+# Jobs are kept in a local SQLite file so they survive restarts and can be
+# shared by every gunicorn worker on the instance. Each worker process runs a
+# few daemon threads that claim queued jobs; the running-job limit is checked
+# inside the claiming transaction, so it holds across processes. A running
+# job's lease is renewed while it runs, so only a job whose worker died is
+# claimed again.
+
+JOBS_DB_PATH = os.environ.get('JOBS_DB_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.sqlite3'))
+JOBS_THREADS = int(os.environ.get('JOBS_THREADS', 2))
+JOBS_MAX_RUNNING = int(os.environ.get('JOBS_MAX_RUNNING', 2))
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 3))
+JOBS_RETRY_DELAY = float(os.environ.get('JOBS_RETRY_DELAY', 5))
+JOBS_LEASE_SECONDS = float(os.environ.get('JOBS_LEASE_SECONDS', 120))
+JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', 1))
+JOBS_KEEP_FINISHED = int(os.environ.get('JOBS_KEEP_FINISHED', 500))
+JOBS_PRUNE_INTERVAL = float(os.environ.get('JOBS_PRUNE_INTERVAL', 60))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    dedupe_key TEXT,
+    created_by TEXT,
+    result TEXT,
+    error TEXT,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    run_after REAL NOT NULL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs (status, run_after);
+CREATE INDEX IF NOT EXISTS jobs_dedupe_idx ON jobs (dedupe_key, status);
+"""
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+
+_tasks = {}
+_local = threading.local()
+_wakeup = threading.Event()
+_started_pid = None
+_start_lock = threading.Lock()
+_schema_ready = set()
+_prune_lock = threading.Lock()
+_last_prune = float('-inf')
+
+
+def task(name, max_attempts=None, max_running=None):
+    """Register a job handler. The handler receives the job payload dict and
+    may return a JSON-serialisable result; raising marks the attempt failed."""
+    def decorator(fn):
+        _tasks[name] = {
+            'fn': fn,
+            'max_attempts': max_attempts or JOBS_MAX_ATTEMPTS,
+            'max_running': max_running,
+        }
+        return fn
+    return decorator
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _connect():
+    # One connection per thread (and per process, since forked children get
+    # a fresh threading.local copy keyed by pid below).
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'pid', None) != os.getpid():
+        conn = sqlite3.connect(JOBS_DB_PATH, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if JOBS_DB_PATH not in _schema_ready:
+            conn.executescript(_SCHEMA)
+            _schema_ready.add(JOBS_DB_PATH)
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job['payload'] = json.loads(job['payload']) if job['payload'] else {}
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    job.pop('lease_until', None)
+    job.pop('run_after', None)
+    return job
+
+
+def enqueue(name, payload=None, created_by=None, dedupe_key=None, max_attempts=None):
+    """Queue a job and return its id. With a dedupe_key, an existing queued or
+    running job with the same key is reused instead of adding a new one."""
+    if name not in _tasks:
+        raise ValueError(f"Unknown job: {name}")
+    start()
+
+    conn = _connect()
+    now = _now_iso()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if dedupe_key:
+            row = conn.execute(
+                'SELECT id FROM jobs WHERE dedupe_key = ? AND status IN (?, ?) LIMIT 1',
+                (dedupe_key, QUEUED, RUNNING)
+            ).fetchone()
+            if row:
+                conn.execute('COMMIT')
+                return row['id']
+
+        job_id = str(uuid.uuid4())
+        conn.execute(
+            'INSERT INTO jobs (id, name, payload, status, attempts, max_attempts, dedupe_key, '
+            'created_by, created_at, updated_at, run_after) VALUES (?, ?, ?, ?, 0, ?, ?, ?, ?, ?, ?)',
+            (job_id, name, json.dumps(payload or {}), QUEUED,
+             max_attempts or _tasks[name]['max_attempts'], dedupe_key, created_by, now, now, time.time())
+        )
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+    _wakeup.set()
+    return job_id
+
+
+def get_job(job_id):
+    row = _connect().execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return _row_to_job(row)
+
+
+def list_jobs(status=None, limit=50):
+    conn = _connect()
+    if status:
+        rows = conn.execute('SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?', (status, limit))
+    else:
+        rows = conn.execute('SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?', (limit,))
+    return [_row_to_job(r) for r in rows.fetchall()]
+
+
+def _claim():
+    conn = _connect()
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # Jobs whose lease ran out belonged to a worker that died mid-run.
+        # One that has used up its attempts (it may be what killed the
+        # worker) fails instead of going round again.
+        conn.execute(
+            'UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? '
+            'WHERE status = ? AND lease_until < ? AND attempts >= max_attempts',
+            (FAILED, 'Worker stopped during the final attempt', _now_iso(), RUNNING, now)
+        )
+        conn.execute(
+            'UPDATE jobs SET status = ?, lease_until = NULL WHERE status = ? AND lease_until < ?',
+            (QUEUED, RUNNING, now)
+        )
+        running = conn.execute('SELECT name, COUNT(*) AS n FROM jobs WHERE status = ? GROUP BY name', (RUNNING,)).fetchall()
+        running_by_name = {r['name']: r['n'] for r in running}
+        if sum(running_by_name.values()) >= JOBS_MAX_RUNNING:
+            conn.execute('COMMIT')
+            return None
+
+        candidates = conn.execute(
+            'SELECT * FROM jobs WHERE status = ? AND run_after <= ? ORDER BY run_after LIMIT 20',
+            (QUEUED, now)
+        ).fetchall()
+        for row in candidates:
+            spec = _tasks.get(row['name'])
+            if spec is None:
+                continue
+            if spec['max_running'] and running_by_name.get(row['name'], 0) >= spec['max_running']:
+                continue
+            conn.execute(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, updated_at = ? WHERE id = ?',
+                (RUNNING, now + JOBS_LEASE_SECONDS, _now_iso(), row['id'])
+            )
+            conn.execute('COMMIT')
+            job = _row_to_job(row)
+            job['attempts'] += 1
+            return job
+        conn.execute('COMMIT')
+        return None
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+
+def _finish(job, status, result=None, error=None, retry_in=None):
+    # Matching on attempts leaves the job alone if it was reclaimed (its
+    # lease ran out) and a newer attempt now owns it.
+    conn = _connect()
+    if retry_in is not None:
+        conn.execute(
+            'UPDATE jobs SET status = ?, error = ?, run_after = ?, lease_until = NULL, updated_at = ? '
+            'WHERE id = ? AND attempts = ?',
+            (QUEUED, error, time.time() + retry_in, _now_iso(), job['id'], job['attempts'])
+        )
+        return
+    conn.execute(
+        'UPDATE jobs SET status = ?, result = ?, error = ?, lease_until = NULL, updated_at = ? '
+        'WHERE id = ? AND attempts = ?',
+        (status, json.dumps(result) if result is not None else None, error, _now_iso(), job['id'], job['attempts'])
+    )
+
+
+def _renew_lease(job, done):
+    # Runs beside the job until it finishes. The attempt check keeps a
+    # straggler from extending a lease some other worker now holds.
+    while not done.wait(JOBS_LEASE_SECONDS / 3):
+        try:
+            _connect().execute(
+                'UPDATE jobs SET lease_until = ? WHERE id = ? AND status = ? AND attempts = ?',
+                (time.time() + JOBS_LEASE_SECONDS, job['id'], RUNNING, job['attempts'])
+            )
+        except Exception as e:
+            print(f"Job {job['id']} lease renewal failed: {e}")
+
+
+def _prune():
+    _connect().execute(
+        'DELETE FROM jobs WHERE status IN (?, ?) AND id NOT IN '
+        '(SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY updated_at DESC LIMIT ?)',
+        (SUCCEEDED, FAILED, SUCCEEDED, FAILED, JOBS_KEEP_FINISHED)
+    )
+
+
+def _prune_if_due():
+    # Pruning takes the database write lock, so each process does it at most
+    # once per JOBS_PRUNE_INTERVAL rather than on every idle poll.
+    global _last_prune
+    now = time.monotonic()
+    with _prune_lock:
+        if now - _last_prune < JOBS_PRUNE_INTERVAL:
+            return
+        _last_prune = now
+    _prune()
+
+
+def run_next():
+    """Claim and run one job on the calling thread. Returns False when there
+    was nothing to run."""
+    job = _claim()
+    if job is None:
+        return False
+
+    spec = _tasks[job['name']]
+    done = threading.Event()
+    threading.Thread(target=_renew_lease, args=(job, done), name=f"job-lease-{job['id']}", daemon=True).start()
+    try:
+        try:
+            result = spec['fn'](job['payload'])
+        finally:
+            done.set()
+        _finish(job, SUCCEEDED, result=result)
+    except Exception as e:
+        print(f"Job {job['name']} ({job['id']}) attempt {job['attempts']} failed: {e}")
+        traceback.print_exc()
+        if job['attempts'] < job['max_attempts']:
+            _finish(job, QUEUED, error=str(e), retry_in=JOBS_RETRY_DELAY * job['attempts'])
+        else:
+            _finish(job, FAILED, error=str(e))
+    return True
+
+
+def _worker_loop():
+    while True:
+        try:
+            if run_next():
+                continue
+            _prune_if_due()
+        except Exception as e:
+            print(f"Job worker error: {e}")
+        _wakeup.wait(JOBS_POLL_INTERVAL)
+        _wakeup.clear()
+
+
+def start():
+    """Start this process's worker threads once. Safe to call on every
+    request; after a fork the new process starts its own threads."""
+    global _started_pid
+    if _started_pid == os.getpid() or JOBS_THREADS <= 0:
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        for i in range(JOBS_THREADS):
+            threading.Thread(target=_worker_loop, name=f"job-worker-{i}", daemon=True).start()
+        _started_pid = os.getpid()
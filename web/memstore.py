@@ -0,0 +1,604 @@
+import copy
+import re
+import sys
+import pickle
+import socket
+import struct
+import argparse
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+# --- In-Memory Storage Stand-In ---
+# A small, thread-safe, in-process imitation of the parts of the Firestore
+# client this app uses: documents and subcollections, set/merge/update with
+# field paths and transforms, simple queries, batches and last-update
+# preconditions. Used with STORAGE_BACKEND=memory for local runs, benchmarks
+# and load tests. Nothing is persisted.
+#
+# Optional per-operation latency (MEMSTORE_LATENCY_MS) stands in for the
+# network round trip; op counts are kept per thread for load-test reporting.
+#
+# By default each process has its own store. To share one between processes
+# (several gunicorn workers, a load generator seeding data), run
+#     python memstore.py --port 7070
+# and set MEMSTORE_ADDRESS=127.0.0.1:7070. The wire format is pickle, so only
+# ever listen on localhost.
+
+
+class Sentinel:
+    def __init__(self, description):
+        self.description = description
+
+    def __repr__(self):
+        return f"Sentinel: {self.description}"
+
+
+DELETE_FIELD = Sentinel('Value used to delete a field in a document.')
+SERVER_TIMESTAMP = Sentinel('Value used to set a document field to the server timestamp.')
+
+
+class ArrayUnion:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class ArrayRemove:
+    def __init__(self, values):
+        self.values = list(values)
+
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
+
+try:
+    # Raise the same exception types as the real client when it's installed,
+    # so callers can catch one type for either backend.
+    from google.api_core.exceptions import (AlreadyExists as _AlreadyExists,
+                                            FailedPrecondition as _FailedPrecondition, NotFound as _NotFound)
+except ImportError:
+    _AlreadyExists = _FailedPrecondition = _NotFound = Exception
+
+
+class AlreadyExists(_AlreadyExists):
+    pass
+
+
+class FailedPrecondition(_FailedPrecondition):
+    pass
+
+
+class NotFound(_NotFound):
+    pass
+
+
+_SIMPLE_FIELD_RE = re.compile(r'^[_a-zA-Z][_a-zA-Z0-9]*$')
+
+
+class FieldPath:
+    def __init__(self, *parts):
+        self.parts = parts
+
+    def to_api_repr(self):
+        quoted = []
+        for part in self.parts:
+            if _SIMPLE_FIELD_RE.match(part):
+                quoted.append(part)
+            else:
+                quoted.append('`' + part.replace('\\', '\\\\').replace('`', '\\`') + '`')
+        return '.'.join(quoted)
+
+
+def _is_delete(value):
+    return type(value).__name__ == 'Sentinel' and 'delete' in str(getattr(value, 'description', '')).lower()
+
+
+def _is_server_timestamp(value):
+    return type(value).__name__ == 'Sentinel' and 'timestamp' in str(getattr(value, 'description', '')).lower()
+
+
+def _transform_kind(value):
+    name = type(value).__name__
+    if name in ('ArrayUnion', 'ArrayRemove', 'Increment'):
+        return name
+    return None
+
+
+def split_field_path(path):
+    """'profiles.`my.profile`.settings' -> ['profiles', 'my.profile', 'settings']"""
+    parts, current, quoted, i = [], '', False, 0
+    while i < len(path):
+        ch = path[i]
+        if ch == '`':
+            quoted = not quoted
+        elif ch == '\\' and quoted and i + 1 < len(path):
+            i += 1
+            current += path[i]
+        elif ch == '.' and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += ch
+        i += 1
+    parts.append(current)
+    return parts
+
+
+def _apply_value(target, key, value):
+    if _is_delete(value):
+        target.pop(key, None)
+        return
+    if _is_server_timestamp(value):
+        target[key] = datetime.now(timezone.utc)
+        return
+    kind = _transform_kind(value)
+    if kind == 'ArrayUnion':
+        current = list(target.get(key) or [])
+        for v in value.values:
+            if v not in current:
+                current.append(copy.deepcopy(v))
+        target[key] = current
+    elif kind == 'ArrayRemove':
+        target[key] = [v for v in (target.get(key) or []) if v not in value.values]
+    elif kind == 'Increment':
+        current = target.get(key)
+        target[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+    else:
+        target[key] = copy.deepcopy(value)
+
+
+def _set_path(data, parts, value):
+    target = data
+    for part in parts[:-1]:
+        child = target.get(part)
+        if not isinstance(child, dict):
+            if _is_delete(value):
+                return
+            child = {}
+            target[part] = child
+        target = child
+    _apply_value(target, parts[-1], value)
+
+
+def _merge(target, source):
+    for key, value in source.items():
+        if isinstance(value, dict) and _transform_kind(value) is None:
+            child = target.get(key)
+            if not isinstance(child, dict):
+                child = {}
+                target[key] = child
+            _merge(child, value)
+        else:
+            _apply_value(target, key, value)
+
+
+def _strip_transforms(data):
+    result = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            result[key] = _strip_transforms(value)
+        else:
+            _apply_value(result, key, value)
+    return result
+
+
+def _get_path(data, parts):
+    for part in parts:
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+
+class _OpCounter(threading.local):
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+
+
+class MemoryStore:
+    def __init__(self, latency_ms=0):
+        self.latency = latency_ms / 1000.0
+        self._lock = threading.RLock()
+        self._docs = {}  # path tuple -> {'data': dict, 'update_time': datetime}
+        self.ops = _OpCounter()
+        self.totals = {'reads': 0, 'writes': 0}
+
+    def _op(self, kind, count=1):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.totals[kind] += count
+        setattr(self.ops, kind, getattr(self.ops, kind) + count)
+
+    def reset_ops(self):
+        self.ops.reads = 0
+        self.ops.writes = 0
+
+    # --- Firestore client surface ---
+
+    def collection(self, name):
+        return CollectionReference(self, (name,))
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        for reference in references:
+            yield reference.get(field_paths=field_paths)
+
+    def write_option(self, last_update_time=None, exists=None):
+        return {'last_update_time': last_update_time, 'exists': exists}
+
+    def clear(self):
+        with self._lock:
+            self._docs.clear()
+
+    # --- Storage operations ---
+    # Everything references and queries need, expressed as plain data so
+    # RemoteStore can forward the same calls to a shared server.
+
+    def _read(self, path, field_paths=None):
+        with self._lock:
+            entry = self._docs.get(path)
+            if not entry:
+                return None, None
+            data, update_time = entry['data'], entry['update_time']
+            if field_paths is not None:
+                masked = {}
+                for field_path in field_paths:
+                    parts = split_field_path(field_path)
+                    value = _get_path(data, parts)
+                    if value is not None:
+                        _set_path(masked, parts, value)
+                data = masked
+            return copy.deepcopy(data), update_time
+
+    def _check(self, path, option):
+        if not option:
+            return
+        entry = self._docs.get(path)
+        if option.get('exists') is True and entry is None:
+            raise NotFound(f"No document at {'/'.join(path)}")
+        if option.get('exists') is False and entry is not None:
+            raise AlreadyExists(f"Document already exists: {'/'.join(path)}")
+        expected = option.get('last_update_time')
+        if expected is not None and (entry is None or entry['update_time'] != expected):
+            raise FailedPrecondition(f"Document {'/'.join(path)} changed since it was read")
+
+    def _apply(self, path, kind, payload=None, option=None):
+        """kind is 'set' (payload: (data, merge)), 'update' (payload: field
+        updates) or 'delete'."""
+        with self._lock:
+            self._check(path, option)
+            entry = self._docs.get(path)
+            data = copy.deepcopy(entry['data']) if entry else None
+            if kind == 'set':
+                document_data, merge = payload
+                if merge:
+                    data = data if data is not None else {}
+                    _merge(data, document_data)
+                else:
+                    data = _strip_transforms(document_data)
+            elif kind == 'update':
+                if data is None:
+                    raise NotFound(f"No document to update: {'/'.join(path)}")
+                for field_path, value in payload.items():
+                    _set_path(data, split_field_path(field_path), value)
+            else:
+                data = None
+
+            if data is None:
+                self._docs.pop(path, None)
+            else:
+                self._docs[path] = {'data': data, 'update_time': datetime.now(timezone.utc)}
+
+    def _commit(self, writes):
+        with self._lock:
+            # All or nothing, like a Firestore batch. _apply never mutates an
+            # entry in place, so the saved ones can simply be put back.
+            saved = {path: self._docs.get(path) for path, _, _, _ in writes}
+            try:
+                for path, kind, payload, option in writes:
+                    self._apply(path, kind, payload, option)
+            except Exception:
+                for path, entry in saved.items():
+                    if entry is None:
+                        self._docs.pop(path, None)
+                    else:
+                        self._docs[path] = entry
+                raise
+
+    def _query(self, collection_path, filters=(), orders=(), limit=None):
+        depth = len(collection_path) + 1
+        results = []
+        with self._lock:
+            for path, entry in self._docs.items():
+                if len(path) != depth or path[:-1] != collection_path:
+                    continue
+                data = entry['data']
+                if all(_OPERATORS[op](_get_path(data, split_field_path(f)), v) for f, op, v in filters):
+                    results.append((path, data, entry['update_time']))
+            results.sort(key=lambda r: r[0])
+            for field_path, direction in reversed(orders):
+                parts = split_field_path(field_path)
+                results = [r for r in results if _get_path(r[1], parts) is not None]
+                results.sort(key=lambda r: _get_path(r[1], parts), reverse=direction == Query.DESCENDING)
+            if limit is not None:
+                results = results[:limit]
+            return [(path, copy.deepcopy(data), update_time) for path, data, update_time in results]
+
+    def _descendant_doc_paths(self, collection_path):
+        depth = len(collection_path) + 1
+        with self._lock:
+            return {p[:depth] for p in self._docs if len(p) >= depth and p[:len(collection_path)] == collection_path}
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, update_time):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+        self.update_time = update_time
+        self.create_time = update_time
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return copy.deepcopy(_get_path(self._data or {}, split_field_path(field_path)))
+
+
+class DocumentReference:
+    def __init__(self, store, path):
+        self._store = store
+        self._path = path
+        self.id = path[-1]
+
+    @property
+    def path(self):
+        return '/'.join(self._path)
+
+    def collection(self, name):
+        return CollectionReference(self._store, self._path + (name,))
+
+    def get(self, field_paths=None, transaction=None):
+        self._store._op('reads')
+        data, update_time = self._store._read(self._path, list(field_paths) if field_paths is not None else None)
+        return DocumentSnapshot(self, data, update_time)
+
+    def create(self, document_data):
+        self._store._op('writes')
+        self._store._apply(self._path, 'set', (document_data, False), {'exists': False})
+
+    def set(self, document_data, merge=False):
+        self._store._op('writes')
+        self._store._apply(self._path, 'set', (document_data, merge))
+
+    def update(self, field_updates, option=None):
+        self._store._op('writes')
+        self._store._apply(self._path, 'update', field_updates, option)
+
+    def delete(self, option=None):
+        self._store._op('writes')
+        self._store._apply(self._path, 'delete', None, option)
+
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+}
+
+
+class Query:
+    DESCENDING = 'DESCENDING'
+    ASCENDING = 'ASCENDING'
+
+    def __init__(self, store, path, filters=(), orders=(), limit_to=None):
+        self._store = store
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit_to
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return Query(self._store, self._path, self._filters + ((field_path, op_string, value),), self._orders, self._limit)
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return Query(self._store, self._path, self._filters, self._orders + ((field_path, direction),), self._limit)
+
+    def limit(self, count):
+        return Query(self._store, self._path, self._filters, self._orders, count)
+
+    def stream(self, transaction=None):
+        rows = self._store._query(self._path, self._filters, self._orders, self._limit)
+        self._store._op('reads', max(1, len(rows)))
+        return iter([DocumentSnapshot(DocumentReference(self._store, path), data, update_time)
+                     for path, data, update_time in rows])
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+
+class CollectionReference(Query):
+    def __init__(self, store, path):
+        super().__init__(store, path)
+        self.id = path[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._store, self._path + (document_id or uuid.uuid4().hex,))
+
+    def add(self, document_data):
+        ref = self.document()
+        ref.set(document_data)
+        return datetime.now(timezone.utc), ref
+
+    def list_documents(self):
+        # Like Firestore, includes documents that only exist as parents of
+        # subcollections.
+        return [DocumentReference(self._store, p) for p in sorted(self._store._descendant_doc_paths(self._path))]
+
+
+class WriteBatch:
+    def __init__(self, store):
+        self._store = store
+        self._writes = []
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append((reference._path, 'set', (document_data, merge), None))
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append((reference._path, 'update', field_updates, option))
+
+    def delete(self, reference, option=None):
+        self._writes.append((reference._path, 'delete', None, option))
+
+    def commit(self):
+        # One round trip for the whole batch.
+        if self._writes:
+            self._store._op('writes', len(self._writes))
+            self._store._commit(self._writes)
+        self._writes = []
+
+
+# --- Shared Store Server ---
+
+def _send(sock, message):
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(struct.pack('!I', len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise EOFError('connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv(sock):
+    (size,) = struct.unpack('!I', _recv_exact(sock, 4))
+    return pickle.loads(_recv_exact(sock, size))
+
+
+_REMOTE_CALLS = {
+    'read': MemoryStore._read,
+    'apply': MemoryStore._apply,
+    'commit': MemoryStore._commit,
+    'query': MemoryStore._query,
+    'descendants': MemoryStore._descendant_doc_paths,
+    'clear': MemoryStore.clear,
+}
+
+
+class RemoteStore(MemoryStore):
+    """A MemoryStore whose documents live in a serve() process. Latency and op
+    counting stay on this side, per calling thread."""
+
+    def __init__(self, address, latency_ms=0):
+        super().__init__(latency_ms)
+        self.address = address
+        self._pool = []
+        self._pool_lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _call(self, name, *args):
+        with self._pool_lock:
+            sock = self._pool.pop() if self._pool else None
+        if sock is None:
+            sock = self._connect()
+        try:
+            _send(sock, (name, args))
+            ok, value = _recv(sock)
+        except BaseException:
+            sock.close()
+            raise
+        with self._pool_lock:
+            self._pool.append(sock)
+        if not ok:
+            raise value
+        return value
+
+    def clear(self):
+        self._call('clear')
+
+    def _read(self, path, field_paths=None):
+        return self._call('read', path, field_paths)
+
+    def _apply(self, path, kind, payload=None, option=None):
+        return self._call('apply', path, kind, payload, option)
+
+    def _commit(self, writes):
+        return self._call('commit', writes)
+
+    def _query(self, collection_path, filters=(), orders=(), limit=None):
+        return self._call('query', collection_path, filters, orders, limit)
+
+    def _descendant_doc_paths(self, collection_path):
+        return self._call('descendants', collection_path)
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+def serve(host='127.0.0.1', port=7070):
+    store = MemoryStore()
+    server = socket.create_server((host, port))
+
+    def handle(conn):
+        with conn:
+            while True:
+                try:
+                    name, args = _recv(conn)
+                except (EOFError, OSError):
+                    return
+                try:
+                    reply = (True, _REMOTE_CALLS[name](store, *args))
+                except Exception as e:
+                    reply = (False, e)
+                _send(conn, reply)
+
+    print(f"Memory store listening on {host}:{server.getsockname()[1]}", flush=True)
+    while True:
+        conn, _ = server.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a shared in-memory store for local runs.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7070)
+    args = parser.parse_args(argv)
+    try:
+        serve(args.host, args.port)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    # Run from the importable module so pickled classes and exceptions
+    # resolve to memstore.X on both ends.
+    import memstore
+    memstore.main(sys.argv[1:])
@@ -0,0 +1,324 @@
+import re
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict, OrderedDict
+from datetime import date
+
+# --- Transaction Search Index ---
+# One index per (user, profile), kept in process memory and stamped with the
+# profile's data version (its last_updated value). Writes made through
+# WebCoinTracker patch the cached index in place; anything else (another
+# worker, an import) changes the version and the index is rebuilt on next use.
+#
+# Search syntax:
+#   text         source contains text, or amount contains the digits (as before)
+#   >500 <=-100  amount comparisons (>, >=, <, <=, =)
+#   -100..-900   amount range, either order, inclusive
+
+SEARCH_INDEX_MAX_PROFILES = 256
+
+_RANGE_RE = re.compile(r'^\s*(-?\d+)\s*\.\.\s*(-?\d+)\s*$')
+_COMPARE_RE = re.compile(r'^\s*(>=|<=|>|<|=)\s*(-?\d+)\s*$')
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TransactionIndex:
+    def __init__(self, transactions, version=None):
+        self.version = version
+        self.lock = threading.RLock()
+        self.rows = {}
+        self.ordered = []                        # (date string, id), ascending
+        self.unparsed_dates = set()              # ids whose date isn't ISO
+        self.source_ids = defaultdict(set)       # source -> ids
+        self.source_names = defaultdict(set)     # lowercased source -> sources
+        self.sorted_sources = []                 # distinct lowercased sources
+        self.source_trigrams = defaultdict(set)  # trigram -> lowercased sources
+        self.amount_ids = defaultdict(set)       # amount -> ids
+        self.sorted_amounts = []                 # distinct amounts
+        self.total_earned = 0                    # over dated rows, like history
+        self.total_spent = 0
+        # Append, then sort once: insort per row is quadratic on unsorted input.
+        for t in transactions:
+            self._add(t, bulk=True)
+        self.ordered.sort()
+        self.sorted_sources.sort()
+        self.sorted_amounts.sort()
+
+    # --- Maintenance ---
+
+    def _add(self, t, bulk=False):
+        # bulk=True appends to the sorted lists; the caller sorts them after.
+        insert = list.append if bulk else insort
+        t_id = t.get('id')
+        if not t_id or t_id in self.rows:
+            return
+        self.rows[t_id] = t
+
+        t_date = t.get('date', '')
+        if t_date:
+            insert(self.ordered, (t_date, t_id))
+            try:
+                date.fromisoformat(t_date[:10])
+            except ValueError:
+                self.unparsed_dates.add(t_id)
+
+        source = t.get('source', '')
+        key = source.lower()
+        if key not in self.source_names:
+            insert(self.sorted_sources, key)
+            for gram in _trigrams(key):
+                self.source_trigrams[gram].add(key)
+        self.source_names[key].add(source)
+        self.source_ids[source].add(t_id)
+
+        amount = t.get('amount', 0)
+        if amount not in self.amount_ids:
+            insert(self.sorted_amounts, amount)
+        self.amount_ids[amount].add(t_id)
+        if t_date:
+            self.total_earned += max(amount, 0)
+            self.total_spent += min(amount, 0)
+
+    def _remove(self, t_id):
+        t = self.rows.pop(t_id, None)
+        if t is None:
+            return
+
+        t_date = t.get('date', '')
+        if t_date:
+            pos = bisect_left(self.ordered, (t_date, t_id))
+            if pos < len(self.ordered) and self.ordered[pos] == (t_date, t_id):
+                self.ordered.pop(pos)
+        self.unparsed_dates.discard(t_id)
+
+        source = t.get('source', '')
+        key = source.lower()
+        ids = self.source_ids.get(source)
+        if ids is not None:
+            ids.discard(t_id)
+            if not ids:
+                del self.source_ids[source]
+                self.source_names[key].discard(source)
+                if not self.source_names[key]:
+                    del self.source_names[key]
+                    self.sorted_sources.pop(bisect_left(self.sorted_sources, key))
+                    for gram in _trigrams(key):
+                        self.source_trigrams[gram].discard(key)
+
+        amount = t.get('amount', 0)
+        ids = self.amount_ids.get(amount)
+        if ids is not None:
+            ids.discard(t_id)
+            if not ids:
+                del self.amount_ids[amount]
+                self.sorted_amounts.pop(bisect_left(self.sorted_amounts, amount))
+        if t_date:
+            self.total_earned -= max(amount, 0)
+            self.total_spent -= min(amount, 0)
+
+    def apply(self, added=(), removed=(), rows=None):
+        """Patch the index after a write. `removed` is a list of ids, `added`
+        a list of transactions (an update is a remove plus an add). `rows`, if
+        given, is the full saved list; its dicts replace the stored ones so
+        recalculated fields like previous_balance stay current."""
+        with self.lock:
+            for t_id in removed:
+                self._remove(t_id)
+            for t in added:
+                self._add(t)
+            if rows is not None:
+                for t in rows:
+                    if t.get('id') in self.rows:
+                        self.rows[t['id']] = t
+
+    # --- Queries ---
+
+    def all_sources(self):
+        with self.lock:
+            return sorted(self.source_ids)
+
+    def sources_with_prefix(self, prefix, limit=10):
+        prefix = prefix.lower()
+        matches = []
+        with self.lock:
+            start = bisect_left(self.sorted_sources, prefix)
+            for key in self.sorted_sources[start:]:
+                if not key.startswith(prefix) or len(matches) >= limit:
+                    break
+                matches.extend(sorted(self.source_names[key]))
+        return matches[:limit]
+
+    def _ids_for_amount_range(self, low, high):
+        ids = set()
+        start = bisect_left(self.sorted_amounts, low)
+        end = bisect_right(self.sorted_amounts, high)
+        for amount in self.sorted_amounts[start:end]:
+            ids |= self.amount_ids[amount]
+        return ids
+
+    def _ids_for_text(self, term):
+        if len(term) >= 3:
+            grams = _trigrams(term)
+            candidates = set.intersection(*(self.source_trigrams.get(g, set()) for g in grams))
+        else:
+            candidates = self.source_names.keys()
+
+        ids = set()
+        for key in candidates:
+            if term in key:
+                for source in self.source_names[key]:
+                    ids |= self.source_ids[source]
+        for amount, amount_ids in self.amount_ids.items():
+            if term in str(amount):
+                ids |= amount_ids
+        return ids
+
+    def search_ids(self, search):
+        match = _RANGE_RE.match(search)
+        if match:
+            low, high = sorted((int(match.group(1)), int(match.group(2))))
+            return self._ids_for_amount_range(low, high)
+
+        match = _COMPARE_RE.match(search)
+        if match:
+            op, value = match.group(1), int(match.group(2))
+            if op == '=':
+                return set(self.amount_ids.get(value, ()))
+            if op in ('>', '>='):
+                low = value + 1 if op == '>' else value
+                return self._ids_for_amount_range(low, float('inf'))
+            high = value - 1 if op == '<' else value
+            return self._ids_for_amount_range(float('-inf'), high)
+
+        return self._ids_for_text(search.lower())
+
+    def _date_bounds(self, filters):
+        try:
+            from_str = date.fromisoformat(filters['date_from'][:10]).isoformat() if filters.get('date_from') else ''
+            to_str = date.fromisoformat(filters['date_to'][:10]).isoformat() if filters.get('date_to') else '9999-12-31'
+        except ValueError:
+            # Same as before: an unreadable date filter is ignored.
+            return '', '9999-12-31'
+        return from_str, to_str
+
+    def _matching_ids(self, filters):
+        search = filters.get('search', '')
+        source = filters.get('source')
+
+        candidates = None
+        if source:
+            candidates = set(self.source_ids.get(source, ()))
+        if search:
+            found = self.search_ids(search)
+            candidates = found if candidates is None else candidates & found
+
+        from_str, to_str = self._date_bounds(filters)
+        start = bisect_left(self.ordered, (from_str,))
+        end = bisect_left(self.ordered, (to_str + '\uffff',))
+
+        # Sorting a small match set beats walking the whole date window;
+        # past roughly 1/8 of the window, the presorted walk is cheaper.
+        if candidates is not None and len(candidates) * 8 < (end - start):
+            keyed = []
+            for t_id in candidates:
+                t_date = self.rows[t_id].get('date')
+                # Rows with unreadable dates were never dropped by the date filter.
+                if t_date and (t_id in self.unparsed_dates or from_str <= t_date[:10] <= to_str):
+                    keyed.append((t_date, t_id))
+            keyed.sort(reverse=True)
+            return [t_id for _, t_id in keyed]
+
+        if candidates is None:
+            keep = [t_id for _, t_id in reversed(self.ordered[start:end])]
+        else:
+            keep = [t_id for _, t_id in reversed(self.ordered[start:end]) if t_id in candidates]
+        if self.unparsed_dates and (start > 0 or end < len(self.ordered)):
+            kept = set(keep)
+            extra = [(self.rows[t_id]['date'], t_id) for t_id in self.unparsed_dates
+                     if t_id not in kept and (candidates is None or t_id in candidates)]
+            if extra:
+                keyed = [(self.rows[t_id]['date'], t_id) for t_id in keep] + extra
+                keyed.sort(reverse=True)
+                keep = [t_id for _, t_id in keyed]
+        return keep
+
+    def query(self, filters, page=1, limit=20):
+        """Return one page of matching transactions (newest first) with the
+        match count and the earned/spent totals across every match."""
+        start_index = (page - 1) * limit
+        with self.lock:
+            if not (filters.get('search') or filters.get('source') or
+                    filters.get('date_from') or filters.get('date_to')):
+                total = len(self.ordered)
+                window = self.ordered[max(0, total - start_index - limit):max(0, total - start_index)]
+                return {
+                    'transactions': [self.rows[t_id] for _, t_id in reversed(window)],
+                    'total_transactions': total,
+                    'total_earned': self.total_earned,
+                    'total_spent': self.total_spent,
+                }
+
+            ids = self._matching_ids(filters)
+            amounts = [self.rows[t_id].get('amount', 0) for t_id in ids]
+            return {
+                'transactions': [self.rows[t_id] for t_id in ids[start_index:start_index + limit]],
+                'total_transactions': len(ids),
+                'total_earned': sum(a for a in amounts if a > 0),
+                'total_spent': sum(a for a in amounts if a < 0),
+            }
+
+
+# --- Per-Process Cache ---
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def get_cached(user_id, profile_name, version):
+    key = (user_id, profile_name)
+    with _cache_lock:
+        index = _cache.get(key)
+        if index is None or version is None or index.version != version:
+            return None
+        _cache.move_to_end(key)
+        return index
+
+
+def build(user_id, profile_name, version, transactions):
+    index = TransactionIndex(transactions, version)
+    if version is not None:
+        with _cache_lock:
+            _cache[(user_id, profile_name)] = index
+            _cache.move_to_end((user_id, profile_name))
+            while len(_cache) > SEARCH_INDEX_MAX_PROFILES:
+                _cache.popitem(last=False)
+    return index
+
+
+def get_or_build(user_id, profile_name, version, transactions):
+    return get_cached(user_id, profile_name, version) or build(user_id, profile_name, version, transactions)
+
+
+def apply_write(user_id, profile_name, old_version, new_version, added=(), removed=(), rows=None):
+    """Bring a cached index forward after a write this process made. If the
+    cache wasn't at old_version it is dropped and rebuilt on next read."""
+    key = (user_id, profile_name)
+    with _cache_lock:
+        index = _cache.get(key)
+        if index is None:
+            return
+        if old_version is None or index.version != old_version:
+            del _cache[key]
+            return
+        index.apply(added, removed, rows)
+        index.version = new_version
+
+
+def invalidate(user_id, profile_name=None):
+    with _cache_lock:
+        for key in list(_cache):
+            if key[0] == user_id and (profile_name is None or key[1] == profile_name):
+                del _cache[key]
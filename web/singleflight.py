@@ -0,0 +1,65 @@
+import threading
+
+# --- Single-Flight Call Coalescing ---
+# Concurrent callers asking for the same key share one execution: the first
+# caller runs the function, the others wait for it and get the same result
+# (or exception). Nothing is cached once the call finishes.
+#
+# Results are shared objects. Callers must treat them as read-only.
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.shared = 0
+
+
+class Group:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.stats = {'calls': 0, 'shared': 0}
+
+    def do(self, key, fn):
+        with self._lock:
+            self.stats['calls'] += 1
+            call = self._calls.get(key)
+            if call is not None:
+                call.shared += 1
+                self.stats['shared'] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def forget(self, key):
+        """Stop new callers from joining the in-flight call for key, e.g.
+        after a write that call's result would no longer reflect."""
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def forget_matching(self, predicate):
+        with self._lock:
+            for key in [k for k in self._calls if predicate(k)]:
+                del self._calls[key]
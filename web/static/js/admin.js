@@ -62,10 +62,42 @@ async function apiCall(endpoint, method = "GET", body = null) {
   }
 }
 
+// --- Job Polling Helper ---
+// Polls until the job finishes. Gives up after timeoutMs (a lost or pruned
+// job would otherwise be polled forever) and reports it as failed.
+async function waitForJob(jobId, intervalMs = 1000, timeoutMs = 5 * 60 * 1000) {
+  const deadline = Date.now() + timeoutMs;
+  while (Date.now() < deadline) {
+    const data = await apiCall(`/api/admin/jobs/${jobId}`);
+    if (!data) return null;
+    if (data.job.status === "succeeded" || data.job.status === "failed") {
+      return data.job;
+    }
+    await new Promise((resolve) => setTimeout(resolve, intervalMs));
+  }
+  return { status: "failed", error: "Timed out waiting for the job to finish." };
+}
+
+let rollupRefreshPending = false;
+
+// Stats and users come from a rollup that is rebuilt in the background when
+// stale; reload both once the rebuild finishes.
+async function refreshWhenRollupReady(jobId) {
+  if (!jobId || rollupRefreshPending) return;
+  rollupRefreshPending = true;
+  const job = await waitForJob(jobId, 2000);
+  rollupRefreshPending = false;
+  if (job && job.status === "succeeded") {
+    loadAdminStats();
+    loadUsers();
+  }
+}
+
 // --- Data Loading Functions ---
 async function loadAdminStats() {
   const data = await apiCall("/api/admin/stats");
   if (!data) return;
+  refreshWhenRollupReady(data.rollup_job_id);
 
   document.getElementById("totalUsers").textContent = data.stats.total_users;
   document.getElementById("totalCoins").textContent =
@@ -80,6 +112,7 @@ async function loadAdminStats() {
 async function loadUsers() {
   const data = await apiCall("/api/admin/users");
   if (!data) return;
+  refreshWhenRollupReady(data.rollup_job_id);
 
   // --- MODIFICATION: Store data and render first page ---
   allUsers = data.users;
@@ -304,7 +337,15 @@ async function deleteUser(userId, tableRow) {
   const result = await apiCall("/api/admin/delete-user", "POST", {
     user_id: userId,
   });
-  if (result && result.success) {
+  if (!result || !result.success) return;
+
+  showToast("Deleting user...", "success");
+  const job = await waitForJob(result.job_id);
+  if (job && job.status === "failed") {
+    showToast(job.error || "Failed to delete user.", "error");
+    return;
+  }
+  if (job) {
     showToast("User deleted successfully.", "success");
     // --- MODIFICATION: Refilter and render after delete ---
     allUsers = allUsers.filter((u) => u.user_id !== userId);
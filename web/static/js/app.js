@@ -78,9 +78,15 @@ class CoinTrackerApp {
     document
       .getElementById("historySourceFilter")
       .addEventListener("change", () => this.loadHistoryPage(1));
+    document
+      .getElementById("historyIncludeArchived")
+      .addEventListener("change", () => this.loadHistoryPage(1));
     document
       .getElementById("historySearch")
-      .addEventListener("input", () => this.loadHistoryPage(1));
+      .addEventListener("input", (e) => {
+        this.loadHistoryPage(1);
+        this.loadSearchSuggestions(e.target.value);
+      });
 
     // --- Settings Page ---
     const addQuickActionBtn = document.getElementById("addQuickActionBtn");
@@ -160,7 +166,17 @@ class CoinTrackerApp {
 
     this.showToast("Importing data...", "success");
 
-    const result = await this.apiCall("/api/import-data", "POST", data);
+    let result = await this.apiCall("/api/import-data", "POST", data);
+
+    // Imports run as a background job; wait for it, then reload the data.
+    if (result && result.job_id) {
+      const job = await this.waitForJob(result.job_id);
+      if (!job || job.status !== "succeeded") {
+        this.showToast((job && job.error) || "Failed to import data.", "error");
+        return;
+      }
+      result = await this.apiCall("/api/data");
+    }
 
     if (result && result.success) {
       this.data = result;
@@ -177,11 +193,29 @@ class CoinTrackerApp {
       this.showToast("Data imported successfully!", "success");
     }
   }
-  exportData() {
+  // Polls until the job finishes. Gives up after timeoutMs (a lost or pruned
+  // job would otherwise be polled forever) and reports it as failed.
+  async waitForJob(jobId, intervalMs = 1000, timeoutMs = 5 * 60 * 1000) {
+    const deadline = Date.now() + timeoutMs;
+    while (Date.now() < deadline) {
+      const data = await this.apiCall(`/api/jobs/${jobId}`);
+      if (!data) return null;
+      if (data.job.status === "succeeded" || data.job.status === "failed") {
+        return data.job;
+      }
+      await new Promise((resolve) => setTimeout(resolve, intervalMs));
+    }
+    return { status: "failed", error: "Timed out waiting for the job to finish." };
+  }
+
+  async exportData() {
+    // The server adds archived transactions, which aren't in this.data.
+    const exported = await this.apiCall("/api/export-data");
+    if (!exported) return;
     try {
       const dataToExport = {
-        settings: this.data.settings,
-        transactions: this.data.transactions,
+        settings: exported.settings,
+        transactions: exported.transactions,
       };
 
       const dataStr = JSON.stringify(dataToExport, null, 2);
@@ -298,7 +332,8 @@ class CoinTrackerApp {
       this.data.balance,
       this.data.goal,
       this.data.progress,
-      this.data.estimated_days
+      this.data.estimated_days,
+      this.data.forecast
     );
     this.updateDashboardStatsUI(this.data.dashboard_stats);
     this.updateQuickActionsUI(this.data.settings.quick_actions);
@@ -342,7 +377,7 @@ class CoinTrackerApp {
 
   // --- TARGETED UI UPDATE FUNCTIONS ---
 
-  updateBalanceAndGoalUI(balance, goal, progress, estimated_days) {
+  updateBalanceAndGoalUI(balance, goal, progress, estimated_days, forecast) {
     document.getElementById(
       "balanceAmount"
     ).textContent = `${balance.toLocaleString()} coins`;
@@ -355,10 +390,15 @@ class CoinTrackerApp {
     const estimateEl = document.getElementById("goalEstimate");
     if (estimated_days === 0) {
       estimateEl.textContent = "🎉 Goal Complete! 🎉";
+    } else if (estimated_days === "N/A" && forecast && forecast.unreachable) {
+      estimateEl.textContent = "Goal not reachable at your current earning rate";
     } else if (estimated_days === "N/A") {
       estimateEl.textContent = "Add earnings to see your estimate";
     } else {
-      estimateEl.textContent = `Estimated time to reach goal: ${estimated_days} days`;
+      const goalDate = forecast && forecast.goal_date
+        ? ` (around ${new Date(forecast.goal_date + "T00:00:00").toLocaleDateString()})`
+        : "";
+      estimateEl.textContent = `Estimated time to reach goal: ${estimated_days} days${goalDate}`;
     }
   }
 
@@ -435,16 +475,15 @@ class CoinTrackerApp {
         t.amount >= 0 ? "+" : ""
       }${t.amount.toLocaleString()}</td>
         <td>${balanceAfter.toLocaleString()}</td>
-        <td class="history-actions">
-            <button class="btn secondary btn-edit" data-id="${
-              t.id
-            }">✎ Edit</button>
-            <button class="btn danger btn-delete" data-id="${
-              t.id
-            }">🗑️ Delete</button>
-        </td>
+        <td class="history-actions">${
+          t.archived
+            ? "Archived"
+            : `<button class="btn secondary btn-edit" data-id="${t.id}">✎ Edit</button>
+            <button class="btn danger btn-delete" data-id="${t.id}">🗑️ Delete</button>`
+        }</td>
       `;
       tbody.appendChild(tr);
+      if (t.archived) return;
 
       // --- MODIFICATION: Add listeners for new buttons ---
       tr.querySelector(".btn-edit").addEventListener("click", (e) => {
@@ -542,6 +581,26 @@ class CoinTrackerApp {
 
   // --- History Pagination Functions ---
 
+  async loadSearchSuggestions(prefix) {
+    const list = document.getElementById("historySearchSuggestions");
+    if (!list) return;
+    // Amount queries (50, >500, -100..-900) have no source suggestions.
+    if (!prefix || /^[\s\d<>=.-]/.test(prefix)) {
+      list.innerHTML = "";
+      return;
+    }
+    const data = await this.apiCall(
+      `/api/sources?prefix=${encodeURIComponent(prefix)}`
+    );
+    if (!data) return;
+    list.innerHTML = "";
+    data.sources.forEach((source) => {
+      const option = document.createElement("option");
+      option.value = source;
+      list.appendChild(option);
+    });
+  }
+
   async loadHistoryPage(page) {
     if (page < 1) page = 1;
     this.historyPage.currentPage = page;
@@ -557,6 +616,8 @@ class CoinTrackerApp {
     if (searchTerm) query += `&search=${encodeURIComponent(searchTerm)}`;
     if (sourceFilter !== "all")
       query += `&source=${encodeURIComponent(sourceFilter)}`;
+    if (document.getElementById("historyIncludeArchived").checked)
+      query += "&include_archived=1";
 
     const data = await this.apiCall(`/api/history${query}`);
 
@@ -691,7 +752,8 @@ class CoinTrackerApp {
           this.data.balance,
           this.data.goal,
           this.data.progress,
-          this.data.estimated_days
+          this.data.estimated_days,
+          this.data.forecast
         );
         this.updateSettingsPageUI(
           this.data.settings,
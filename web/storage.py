@@ -0,0 +1,188 @@
+import os
+import itertools
+import threading
+
+# --- Storage Client ---
+# The app's storage client is created on first use, once per process, instead
+# of at import time. Importing the app stays cheap, every gunicorn worker
+# builds its own client after the fork (gRPC channels must not be shared with
+# a parent process), and workers can run on the in-memory stand-in without
+# touching Firebase.
+#
+# STORAGE_BACKEND:
+#   firestore  Firestore via firebase_admin credentials (default)
+#   memory     memstore.MemoryStore, nothing persisted (local runs, benchmarks);
+#              with MEMSTORE_ADDRESS, one store shared by every process
+#
+# Each Firestore client multiplexes concurrent calls over one gRPC channel
+# (one HTTP/2 connection, ~100 concurrent streams). Under gevent workers a
+# process can have far more requests in flight than that, so
+# STORAGE_CHANNELS > 1 keeps a small pool of clients; each thread or greenlet
+# sticks to one of them for the whole request.
+#
+# Firestore helper values (ArrayUnion, DELETE_FIELD, FieldPath, NotFound, ...)
+# are attributes of this module and resolve to the active backend's versions.
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firestore')
+MEMSTORE_LATENCY_MS = float(os.environ.get('MEMSTORE_LATENCY_MS', 0))
+MEMSTORE_ADDRESS = os.environ.get('MEMSTORE_ADDRESS', '')
+STORAGE_CHANNELS = max(1, int(os.environ.get('STORAGE_CHANNELS', 1)))
+
+_HELPERS = ('ArrayUnion', 'ArrayRemove', 'Increment', 'DELETE_FIELD', 'SERVER_TIMESTAMP',
+            'FieldPath', 'NotFound', 'FailedPrecondition', 'AlreadyExists')
+
+_lock = threading.Lock()
+_clients = []
+_client_pid = None
+_failed_pid = None
+_credentials = None
+# Each thread (greenlet, under gevent) takes the next slot on first use.
+_slots = itertools.count()
+_slot = threading.local()
+
+
+def load_firestore_credentials():
+    """Import firebase_admin and load the service account. Safe to call before
+    forking (it opens no connections); gunicorn --preload uses it so workers
+    inherit the imports."""
+    global _credentials
+    if _credentials is not None:
+        return _credentials
+
+    from firebase_admin import credentials
+
+    required_env_vars = ['FIREBASE_PROJECT_ID', 'FIREBASE_PRIVATE_KEY', 'FIREBASE_CLIENT_EMAIL']
+    if all(os.getenv(key) for key in required_env_vars):
+        print("Loading Firebase credentials from environment variables...")
+        private_key = os.getenv('FIREBASE_PRIVATE_KEY').replace('\\n', '\n')
+        firebase_config = {
+            "type": "service_account",
+            "project_id": os.getenv('FIREBASE_PROJECT_ID'),
+            "private_key_id": os.getenv('FIREBASE_PRIVATE_KEY_ID', ''),
+            "private_key": private_key,
+            "client_email": os.getenv('FIREBASE_CLIENT_EMAIL'),
+            "client_id": os.getenv('FIREBASE_CLIENT_ID', ''),
+            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+            "token_uri": "https://oauth2.googleapis.com/token",
+            "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
+        }
+        _credentials = credentials.Certificate(firebase_config)
+    elif os.path.exists('firebase-key.json'):
+        print("Loading Firebase credentials from firebase-key.json...")
+        _credentials = credentials.Certificate('firebase-key.json')
+    else:
+        raise Exception("No Firebase configuration found. Set environment variables or provide firebase-key.json.")
+    return _credentials
+
+
+def _create_client():
+    if STORAGE_BACKEND == 'memory':
+        import memstore
+        if MEMSTORE_ADDRESS:
+            print(f"Using shared in-memory storage at {MEMSTORE_ADDRESS} (latency {MEMSTORE_LATENCY_MS:g}ms).")
+            return memstore.RemoteStore(memstore.parse_address(MEMSTORE_ADDRESS), latency_ms=MEMSTORE_LATENCY_MS)
+        print(f"Using in-memory storage (latency {MEMSTORE_LATENCY_MS:g}ms). Nothing is persisted.")
+        return memstore.MemoryStore(latency_ms=MEMSTORE_LATENCY_MS)
+
+    cred = load_firestore_credentials()
+    # Built directly rather than through firebase_admin.firestore.client(),
+    # which caches one client per firebase app and would hand a forked worker
+    # its parent's channel.
+    from google.cloud import firestore
+    return firestore.Client(project=cred.project_id, credentials=cred.get_credential())
+
+
+def _pick(clients):
+    if len(clients) == 1:
+        return clients[0]
+    # Round-robin rather than get_ident(): idents are aligned addresses, so
+    # taking them modulo a small pool size maps nearly everything to slot 0.
+    slot = getattr(_slot, 'index', None)
+    if slot is None:
+        slot = _slot.index = next(_slots)
+    return clients[slot % len(clients)]
+
+
+def get_client():
+    """The calling thread's storage client, or None if it can't be created. A
+    failed attempt isn't retried in the same process."""
+    global _clients, _client_pid, _failed_pid
+    pid = os.getpid()
+    clients = _clients
+    if clients and _client_pid == pid:
+        return _pick(clients)
+    if _failed_pid == pid:
+        return None
+    with _lock:
+        if _clients and _client_pid == pid:
+            return _pick(_clients)
+        if _failed_pid == pid:
+            return None
+        try:
+            count = 1 if STORAGE_BACKEND == 'memory' else STORAGE_CHANNELS
+            _clients = [_create_client() for _ in range(count)]
+            _client_pid = pid
+            print(f"✅ Storage client ready (pid {pid}, {count} channel{'s' if count > 1 else ''})")
+        except ImportError:
+            print("⚠️ Firebase library not found. Running in offline mode.")
+            _clients, _failed_pid = [], pid
+        except Exception as e:
+            print(f"❌ Firebase init error: {e}")
+            _clients, _failed_pid = [], pid
+        return _pick(_clients) if _clients else None
+
+
+def use(client):
+    """Install a ready-made client for this process (tests, benchmarks)."""
+    global _clients, _client_pid, _failed_pid
+    with _lock:
+        _clients, _client_pid, _failed_pid = [client], os.getpid(), None
+
+
+def preload():
+    """Do the import-time work of the configured backend without connecting."""
+    if STORAGE_BACKEND == 'memory':
+        import memstore  # noqa: F401
+        return
+    try:
+        load_firestore_credentials()
+        from google.cloud import firestore  # noqa: F401
+    except Exception as e:
+        # get_client() reports the same problem in each worker.
+        print(f"Storage preload skipped: {e}")
+
+
+class _LazyClient:
+    """Module-level stand-in for the client. Attribute access creates the
+    client on first use; truthiness says whether storage is available."""
+
+    def __getattr__(self, name):
+        client = get_client()
+        if client is None:
+            raise RuntimeError('Storage is not available')
+        return getattr(client, name)
+
+    def __bool__(self):
+        return get_client() is not None
+
+    def __repr__(self):
+        return f"<lazy {STORAGE_BACKEND} storage client>"
+
+
+db = _LazyClient()
+
+
+def __getattr__(name):
+    if name not in _HELPERS:
+        raise AttributeError(name)
+    if STORAGE_BACKEND == 'memory':
+        import memstore
+        return getattr(memstore, name)
+    if name == 'FieldPath':
+        from google.cloud.firestore_v1.field_path import FieldPath
+        return FieldPath
+    if name in ('NotFound', 'FailedPrecondition', 'AlreadyExists'):
+        from google.api_core import exceptions
+        return getattr(exceptions, name)
+    from google.cloud import firestore
+    return getattr(firestore, name)